@@ -1,81 +1,174 @@
 from flask import Flask, jsonify, request
-from meal_recommender import MealRecommender
+from meal_recommender import MealRecommender, PlanWorkerPool
 import json
 from datetime import datetime
 import random
 from dotenv import load_dotenv
 import os
+import threading
+import atexit
+import shutil
+import tempfile
 from pymongo import MongoClient
 from run_recommender import modify_meal_plan
+from plan_cache import PlanCache
+from catalog_sync import CatalogSync
+from setup_mongodb import build_menu_pipeline, aggregate_menu_items
 
 app = Flask(__name__)
 
-def get_mongodb_data():
+# Process-wide recommender shared by all requests, swapped whole on refresh
+_recommender = None
+_recommender_lock = threading.Lock()
+# Serializes catalog writers (refreshes and incremental updates) so none is lost
+_update_lock = threading.Lock()
+
+# Compiled catalog snapshot to start from instead of querying MongoDB (see setup_mongodb.py --snapshot)
+MEAL_CATALOG_SNAPSHOT = os.getenv('MEAL_CATALOG_SNAPSHOT')
+
+# One pooled MongoDB client shared by every request and the catalog sync
+_mongo_client = None
+_mongo_client_lock = threading.Lock()
+MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', '20'))
+
+# Campuses whose menus make up the catalog
+MENU_CAMPUSES = [campus.strip() for campus in os.getenv('MENU_CAMPUSES', 'UMD').split(',') if campus.strip()]
+
+# Worker processes used to build batch plans (1 keeps batches in-process)
+PLAN_WORKERS = int(os.getenv('PLAN_WORKERS', '1'))
+# Long-lived batch workers, planning from a snapshot of the current catalog (see start_plan_pool())
+_plan_pool = None
+# Where catalog snapshots for the workers are written (a temporary directory by default)
+PLAN_SNAPSHOT_DIR = os.getenv('PLAN_SNAPSHOT_DIR')
+# Snapshots written for the workers, oldest first
+_plan_snapshots = []
+
+# Seconds between catalog syncs from MongoDB (0 disables the background sync)
+CATALOG_SYNC_INTERVAL = float(os.getenv('CATALOG_SYNC_INTERVAL', '0'))
+# Follow a change stream instead of polling updatedAt (needs a replica set, e.g. Atlas)
+CATALOG_SYNC_CHANGE_STREAM = os.getenv('CATALOG_SYNC_CHANGE_STREAM', '0') == '1'
+
+# Finished plan responses keyed on the normalized request and catalog version (size 0 disables)
+plan_cache = PlanCache(maxsize=int(os.getenv('PLAN_CACHE_SIZE', '0')),
+                       ttl=float(os.getenv('PLAN_CACHE_TTL', '300')))
+
+def get_mongo_client():
+    """Return the app's pooled MongoDB client, connecting on first use"""
+    global _mongo_client
+    client = _mongo_client
+    if client is None:
+        with _mongo_client_lock:
+            if _mongo_client is None:
+                # Load environment variables
+                load_dotenv()
+                
+                # Get MongoDB URI from environment
+                mongo_uri = os.getenv('MONGO_URI')
+                if not mongo_uri:
+                    raise ValueError("MONGO_URI environment variable not set")
+                
+                _mongo_client = MongoClient(mongo_uri, maxPoolSize=MONGO_MAX_POOL_SIZE)
+                atexit.register(_mongo_client.close)
+            client = _mongo_client
+    return client
+
+def get_database():
+    return get_mongo_client().test
+
+def get_mongodb_data(category=None, meal_type=None):
     """Get data directly from MongoDB"""
-    # Load environment variables
-    load_dotenv()
-    
-    # Get MongoDB URI from environment
-    mongo_uri = os.getenv('MONGO_URI')
-    if not mongo_uri:
-        raise ValueError("MONGO_URI environment variable not set")
-    
     try:
-        # Connect to MongoDB
-        client = MongoClient(mongo_uri)
-        
-        # Test the connection
-        client.admin.command('ping')
-        
-        # Create or get the database
-        db = client.test
-        
         # Get the restaurants collection
-        restaurants_collection = db.restaurants
-        
-        # Get all menu items using aggregation pipeline
-        pipeline = [
-            {"$match": {"campus": {"$in": ["UMD"]}}},
-            {"$unwind": "$menu"},
-            {"$unwind": "$menu.items"},
-            {
-                "$lookup": {
-                    "from": "meals",
-                    "localField": "menu.items",
-                    "foreignField": "_id",
-                    "as": "mealDetails"
-                }
-            },
-            {"$unwind": "$mealDetails"},
-            {"$match": {"mealDetails.nutrients.calories": {"$gt": 0}}},
-            {"$match": {"mealDetails._id": {"$ne": None}}},
-            {
-                "$project": {
-                    "mealName": "$mealDetails.name",
-                    "mealType": "$mealDetails.type",
-                    "ingredients": "$mealDetails.ingredients",
-                    "allergens": "$mealDetails.allergens",
-                    "dietaryPreferences": "$mealDetails.dietaryPreferences",
-                    "serving": "$mealDetails.serving",
-                    "calories": "$mealDetails.nutrients.calories",
-                    "protein": "$mealDetails.nutrients.protein",
-                    "fat": "$mealDetails.nutrients.fat",
-                    "carbohydrate": "$mealDetails.nutrients.carbohydrate",
-                    "restaurantName": "$name",
-                    "restaurantId": "$_id",
-                    "category": "$category",
-                    "mealId": "$mealDetails._id"
-                }
-            }
-        ]
+        restaurants_collection = get_database().restaurants
+        
+        # Get menu items using the aggregation pipeline, filtered before the meal lookup
+        pipeline = build_menu_pipeline(MENU_CAMPUSES, category=category, meal_type=meal_type, sort=False)
         
-        menu_items = list(restaurants_collection.aggregate(pipeline))
-        return menu_items
+        # Return the cursor itself so the recommender can consume it as it streams
+        return aggregate_menu_items(restaurants_collection, pipeline)
         
     except Exception as e:
         print(f"An error occurred while connecting to MongoDB: {str(e)}")
         raise
 
+def build_recommender():
+    """Build a recommender from the current MongoDB menu"""
+    return MealRecommender.from_records(get_mongodb_data())
+
+def load_recommender():
+    """Initial catalog: the compiled snapshot when configured, otherwise a MongoDB build"""
+    if MEAL_CATALOG_SNAPSHOT:
+        return MealRecommender.from_snapshot(MEAL_CATALOG_SNAPSHOT)
+    return build_recommender()
+
+def get_recommender():
+    """Return the shared recommender, building it on first use"""
+    global _recommender
+    recommender = _recommender
+    if recommender is None:
+        with _recommender_lock:
+            if _recommender is None:
+                _recommender = load_recommender().freeze()
+            recommender = _recommender
+    return recommender
+
+def refresh_recommender():
+    """Rebuild the catalog and atomically swap it in for new requests"""
+    global _recommender
+    # Build outside the read lock so requests keep using the old catalog meanwhile
+    with _update_lock:
+        recommender = build_recommender().freeze()
+        with _recommender_lock:
+            _recommender = recommender
+        publish_plan_snapshot(recommender)
+    # Entries are keyed on the old catalog version and can never hit again
+    plan_cache.clear()
+    return recommender
+
+def apply_catalog_updates(upserts, removed_ids=()):
+    """Patch changed meals into the live catalog and swap the result in"""
+    global _recommender
+    with _update_lock:
+        recommender = get_recommender().with_updates(upserts, removed_ids).freeze()
+        with _recommender_lock:
+            _recommender = recommender
+        publish_plan_snapshot(recommender)
+    plan_cache.clear()
+    return recommender
+
+def start_plan_pool(recommender):
+    """Start the batch workers and point them at recommender's catalog; without them batches run in-process"""
+    global _plan_pool, PLAN_SNAPSHOT_DIR
+    if PLAN_WORKERS > 1:
+        if PLAN_SNAPSHOT_DIR is None:
+            PLAN_SNAPSHOT_DIR = tempfile.mkdtemp(prefix='meal-plan-snapshots-')
+            atexit.register(shutil.rmtree, PLAN_SNAPSHOT_DIR, True)
+        _plan_pool = PlanWorkerPool(PLAN_WORKERS)
+        atexit.register(_plan_pool.close)
+        publish_plan_snapshot(recommender)
+    return _plan_pool
+
+def publish_plan_snapshot(recommender):
+    """Hand the batch workers a snapshot of recommender's catalog, exporting one if it has none"""
+    if _plan_pool is None:
+        return None
+    path = getattr(recommender, 'snapshot_path', None)
+    if path is None:
+        path = os.path.join(PLAN_SNAPSHOT_DIR, f"catalog-{recommender.catalog_version}")
+        recommender.export_snapshot(path)
+        _plan_snapshots.append(path)
+    _plan_pool.use_snapshot(recommender, path)
+    # Batches started just before the swap may still load the previous snapshot; older ones can go
+    while len(_plan_snapshots) > 2:
+        shutil.rmtree(_plan_snapshots.pop(0), ignore_errors=True)
+    return path
+
+def start_catalog_sync(since=None):
+    """Start the background sync that feeds menu changes made after since into the live catalog"""
+    sync = CatalogSync(get_database(), get_recommender, apply_catalog_updates, campuses=MENU_CAMPUSES,
+                       interval=CATALOG_SYNC_INTERVAL, since=since, use_change_stream=CATALOG_SYNC_CHANGE_STREAM)
+    return sync.start()
+
 def format_meal_plan(meal_plan):
     """Format the meal plan for display"""
     formatted_plan = []
@@ -135,6 +228,100 @@ def format_meal_plan(meal_plan):
     
     return formatted_plan
 
+def request_rng(data):
+    """Random source owned by one request, seeded when the body carries a seed"""
+    return random.Random(data.get('seed'))
+
+def plan_request_key(data, recommender):
+    """Cache key for a plan request, or None when the response involves unseeded random choices"""
+    option = data.get('option', 1)
+    preferred_meals = data.get('preferred_meals', ['breakfast', 'lunch', 'dinner'])
+    if data.get('seed') is None:
+        if option == 1 and len(preferred_meals) != 2:
+            return None
+        if option == 2 and 'meal_to_remove' not in data:
+            return None
+        if option not in (1, 2) and 'meals_to_remove' not in data:
+            return None
+    
+    normalized = {
+        'goal': str(data.get('goal', 'maintain')).lower(),
+        'target_calories': data.get('target_calories', 2000),
+        'days': data.get('days', 7),
+        'option': option,
+        'preferred_meals': sorted(preferred_meals) if option == 1 else None,
+        'meal_to_remove': data.get('meal_to_remove') if option == 2 else None,
+        'meals_to_remove': data.get('meals_to_remove') if option not in (1, 2) else None,
+        'seed': data.get('seed')
+    }
+    return recommender.catalog_version, json.dumps(normalized, sort_keys=True, default=str)
+
+def parse_plan_request(data, rng=None):
+    """Read plan parameters from a request body
+    
+    rng makes the random meal removals and defaults to request_rng(data).
+    Returns (user_prefs, days, meals_to_remove, days_to_modify).
+    """
+    if rng is None:
+        rng = request_rng(data)
+
+    # Get parameters from request
+    goal = data.get('goal', 'maintain')
+    target_calories = data.get('target_calories', 2000)
+    days = data.get('days', 7)
+    option = data.get('option', 1)
+    
+    # Get meal preferences based on option
+    if option == 1:
+        # For 19 meals option, get preferred meals
+        preferred_meals = data.get('preferred_meals', ['breakfast', 'lunch', 'dinner'])
+        if len(preferred_meals) == 3:
+            # If all three selected, randomly select one meal to remove from 2 random days
+            all_meals = ['breakfast', 'lunch', 'dinner']
+            meals_to_remove = rng.sample(all_meals, 1)  # Randomly select one meal to remove
+            days_to_modify = rng.sample(range(3), 2)  # First 3 days are franchise days
+        elif len(preferred_meals) == 2:
+            # If two selected, remove the unselected one
+            all_meals = ['breakfast', 'lunch', 'dinner']
+            meals_to_remove = [meal for meal in all_meals if meal not in preferred_meals]
+            days_to_modify = range(3)  # All franchise days
+        else:
+            # If one selected, randomly select one meal from unselected types
+            all_meals = ['breakfast', 'lunch', 'dinner']
+            unselected = [meal for meal in all_meals if meal not in preferred_meals]
+            meals_to_remove = rng.sample(unselected, 1)  # Randomly select one meal from unselected
+            days_to_modify = range(3)  # All franchise days
+    elif option == 2:
+        # For 14 meals option, get which meal to remove
+        meal_to_remove = data.get('meal_to_remove', rng.choice(['breakfast', 'lunch', 'dinner']))
+        meals_to_remove = [meal_to_remove]
+        days_to_modify = range(7)  # All days
+    else:  # option 3
+        # For 7 meals option, get which two meals to remove
+        meals_to_remove = data.get('meals_to_remove', rng.sample(['breakfast', 'lunch', 'dinner'], 2))
+        days_to_modify = range(7)  # All days
+
+    # User preferences
+    user_prefs = {
+        'goal': goal,
+        'target_calories': target_calories,
+        'allergies': [],
+        'exercise': 'Regular exercise',
+        'preferred_locations': [],
+        'novelty_factor': 0.5,
+        'dietary_restrictions': []
+    }
+    
+    return user_prefs, days, meals_to_remove, days_to_modify
+
+def remove_meals(meal_plan, meals_to_remove, days_to_modify):
+    """Modify meal plan based on option and meals to remove"""
+    for day_idx in days_to_modify:
+        for meal_type in meals_to_remove:
+            if meal_type in meal_plan[day_idx]['meals_by_type']:
+                del meal_plan[day_idx]['meals_by_type'][meal_type]
+    return meal_plan
+
 @app.route('/api/meal-recommendations', methods=['POST'])
 def get_meal_recommendations():
     try:
@@ -146,66 +333,18 @@ def get_meal_recommendations():
                 'message': 'No data provided in request body'
             }), 400
 
-        # Get parameters from request
-        goal = data.get('goal', 'maintain')
-        target_calories = data.get('target_calories', 2000)
-        days = data.get('days', 7)
-        option = data.get('option', 1)
-        
-        # Get meal preferences based on option
-        if option == 1:
-            # For 19 meals option, get preferred meals
-            preferred_meals = data.get('preferred_meals', ['breakfast', 'lunch', 'dinner'])
-            if len(preferred_meals) == 3:
-                # If all three selected, randomly select one meal to remove from 2 random days
-                all_meals = ['breakfast', 'lunch', 'dinner']
-                meals_to_remove = random.sample(all_meals, 1)  # Randomly select one meal to remove
-                days_to_modify = random.sample(range(3), 2)  # First 3 days are franchise days
-            elif len(preferred_meals) == 2:
-                # If two selected, remove the unselected one
-                all_meals = ['breakfast', 'lunch', 'dinner']
-                meals_to_remove = [meal for meal in all_meals if meal not in preferred_meals]
-                days_to_modify = range(3)  # All franchise days
-            else:
-                # If one selected, randomly select one meal from unselected types
-                all_meals = ['breakfast', 'lunch', 'dinner']
-                unselected = [meal for meal in all_meals if meal not in preferred_meals]
-                meals_to_remove = random.sample(unselected, 1)  # Randomly select one meal from unselected
-                days_to_modify = range(3)  # All franchise days
-        elif option == 2:
-            # For 14 meals option, get which meal to remove
-            meal_to_remove = data.get('meal_to_remove', random.choice(['breakfast', 'lunch', 'dinner']))
-            meals_to_remove = [meal_to_remove]
-            days_to_modify = range(7)  # All days
-        else:  # option 3
-            # For 7 meals option, get which two meals to remove
-            meals_to_remove = data.get('meals_to_remove', random.sample(['breakfast', 'lunch', 'dinner'], 2))
-            days_to_modify = range(7)  # All days
-
-        # Get data directly from MongoDB
-        menu_items = get_mongodb_data()
-        
-        # Save to temporary JSON file for the recommender
-        temp_json = 'temp_menu_data.json'
-        with open(temp_json, 'w', encoding='utf-8') as f:
-            json.dump(menu_items, f, default=str, indent=2)
-        
-        # Initialize the recommender with the temporary data
-        recommender = MealRecommender(temp_json)
-
-        # User preferences
-        user_prefs = {
-            'goal': goal,
-            'target_calories': target_calories,
-            'allergies': [],
-            'exercise': 'Regular exercise',
-            'preferred_locations': [],
-            'novelty_factor': 0.5,
-            'dietary_restrictions': []
-        }
+        # Use the warm shared catalog; keep a local reference for the whole request
+        recommender = get_recommender()
+        
+        # Identical deterministic requests against the same catalog get the stored response
+        cache_key = plan_request_key(data, recommender) if plan_cache.maxsize > 0 else None
+        if cache_key is not None:
+            cached_plan = plan_cache.get(cache_key)
+            if cached_plan is not None:
+                return jsonify(cached_plan)
 
-        # Set user preferences
-        recommender.set_user_preferences(user_prefs)
+        # Preferences stay request-local; the shared recommender is never written to
+        user_prefs, days, meals_to_remove, days_to_modify = parse_plan_request(data)
 
         user_id = "student_123"
         
@@ -213,16 +352,13 @@ def get_meal_recommendations():
         meal_plan = recommender.recommend_meal_plan(user_id, user_prefs, days=days)
         
         # Modify meal plan based on option and meals to remove
-        for day_idx in days_to_modify:
-            for meal_type in meals_to_remove:
-                if meal_type in meal_plan[day_idx]['meals_by_type']:
-                    del meal_plan[day_idx]['meals_by_type'][meal_type]
+        remove_meals(meal_plan, meals_to_remove, days_to_modify)
         
         # Get the formatted meal plan
-        formatted_plan = recommender.display_meal_plan(meal_plan)
+        formatted_plan = recommender.display_meal_plan(meal_plan, user_prefs)
         
-        # Clean up temporary file
-        os.remove(temp_json)
+        if cache_key is not None:
+            plan_cache.put(cache_key, formatted_plan)
         
         return jsonify(formatted_plan)
 
@@ -232,5 +368,127 @@ def get_meal_recommendations():
             'message': str(e)
         }), 500
 
+@app.route('/api/meal-recommendations/batch', methods=['POST'])
+def get_batch_meal_recommendations():
+    try:
+        # Expect {"requests": [{"user_id": ..., "goal": ..., "target_calories": ...}, ...]}
+        data = request.get_json()
+        if not data or not data.get('requests'):
+            return jsonify({
+                'status': 'error',
+                'message': 'A non-empty requests list must be provided in request body'
+            }), 400
+
+        recommender = get_recommender()
+        
+        # Parse every entry first; a bad entry only fails that user
+        results = []
+        parsed = []
+        for idx, entry in enumerate(data['requests']):
+            user_id = entry.get('user_id', f"user_{idx}") if isinstance(entry, dict) else f"user_{idx}"
+            try:
+                parsed.append((idx, parse_plan_request(entry)))
+                results.append(None)
+            except Exception as e:
+                results.append({'user_id': user_id, 'status': 'error', 'message': str(e)})
+        
+        # Generate all plans together so users with the same goal and calories share the work
+        plan_results = recommender.recommend_meal_plans(
+            [(data['requests'][idx].get('user_id', f"user_{idx}"), options[0]) for idx, options in parsed],
+            pool=_plan_pool)
+        
+        for (idx, options), plan_result in zip(parsed, plan_results):
+            user_prefs, days, meals_to_remove, days_to_modify = options
+            if plan_result['status'] == 'success':
+                try:
+                    meal_plan = remove_meals(plan_result['meal_plan'], meals_to_remove, days_to_modify)
+                    plan_result = {
+                        'user_id': plan_result['user_id'],
+                        'status': 'success',
+                        'plan': recommender.display_meal_plan(meal_plan, user_prefs)
+                    }
+                except Exception as e:
+                    plan_result = {'user_id': plan_result['user_id'], 'status': 'error', 'message': str(e)}
+            results[idx] = plan_result
+        
+        return jsonify({
+            'status': 'success',
+            'results': results
+        })
+
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+@app.route('/api/similar-meals', methods=['POST'])
+def get_similar_meals():
+    try:
+        data = request.get_json()
+        meal_ids = data.get('meal_ids') if data else None
+        if not meal_ids or not isinstance(meal_ids, list) or not all(isinstance(meal_id, str) for meal_id in meal_ids):
+            return jsonify({
+                'status': 'error',
+                'message': 'meal_ids must be provided in request body as a list of mealIds'
+            }), 400
+
+        num_similar = data.get('num_similar', 5)
+        if type(num_similar) is not int or num_similar < 1:
+            return jsonify({
+                'status': 'error',
+                'message': 'num_similar must be a positive integer'
+            }), 400
+
+        recommender = get_recommender()
+        similar_meals = recommender.get_similar_meals_batch(meal_ids, num_similar)
+        
+        return jsonify({
+            'status': 'success',
+            'similar_meals': similar_meals
+        })
+
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+@app.route('/api/stats', methods=['GET'])
+def get_stats():
+    return jsonify({
+        'status': 'success',
+        'goal_profile_cache': MealRecommender.goal_profile_cache_info(),
+        'plan_cache': plan_cache.stats()
+    })
+
+@app.route('/api/meal-recommendations/refresh', methods=['POST'])
+def refresh_meal_catalog():
+    try:
+        recommender = refresh_recommender()
+        return jsonify({
+            'status': 'success',
+            'meals': len(recommender.meals)
+        })
+
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
 if __name__ == '__main__':
-    app.run(debug=True) 
\ No newline at end of file
+    debug = True
+    # In debug mode the reloader's watcher process runs this block too but never serves;
+    # only the serving child (WERKZEUG_RUN_MAIN) loads the catalog and syncs it
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        # Warm the catalog before accepting requests; the sync picks up anything changed since
+        catalog_read_at = datetime.utcnow()
+        recommender = get_recommender()
+        # Batch workers load the catalog from a snapshot rather than forking this process
+        start_plan_pool(recommender)
+        if CATALOG_SYNC_INTERVAL > 0:
+            # A snapshot is as fresh as its export, so sync everything changed after that
+            start_catalog_sync(since=getattr(recommender, 'snapshot_created_at', catalog_read_at))
+    # One frozen catalog serves every request thread without locking
+    app.run(debug=debug, threaded=True)
\ No newline at end of file
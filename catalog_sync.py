@@ -0,0 +1,142 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from pymongo.errors import OperationFailure
+from setup_mongodb import build_menu_pipeline, aggregate_menu_items
+
+class CatalogSync:
+    """Push changed meals from MongoDB into a live recommender
+
+    Polls the restaurants and meals collections for documents whose
+    updatedAt moved past the last sync, or follows a change stream when the
+    deployment supports one (catching up from since whenever it opens), and
+    re-reads only the affected meals through the menu pipeline.
+    get_recommender returns the live recommender and apply_updates(upserts,
+    removed_ids) swaps in the updated one. db is any pymongo-compatible
+    database, so mongomock works as a stand-in.
+    """
+    def __init__(self, db, get_recommender, apply_updates, campuses=('UMD',), interval=60,
+                 since=None, lag=5, use_change_stream=False):
+        self.db = db
+        self.get_recommender = get_recommender
+        self.apply_updates = apply_updates
+        self.campuses = tuple(campuses)
+        self.interval = interval
+        # Documents touched right before the catalog was built are re-read; upserts are idempotent
+        self.since = since or datetime.utcnow()
+        self.lag = timedelta(seconds=lag)
+        self.use_change_stream = use_change_stream
+        self._resume_token = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def changed_meal_ids(self, since, until=None):
+        """mealIds touched since the given time, through their own or a restaurant's document"""
+        window = {'$gt': since - self.lag}
+        if until is not None:
+            window['$lte'] = until
+        meal_ids = {str(meal['_id']) for meal in self.db.meals.find({'updatedAt': window}, {'_id': 1})}
+
+        restaurant_ids = set()
+        for restaurant in self.db.restaurants.find({'updatedAt': window}, {'menu.items': 1}):
+            restaurant_ids.add(str(restaurant['_id']))
+            meal_ids.update(self._menu_meal_ids(restaurant))
+        return meal_ids | self._catalog_meal_ids(restaurant_ids)
+
+    def _menu_meal_ids(self, restaurant):
+        return {str(item) for section in restaurant.get('menu', []) for item in section.get('items', [])}
+
+    def _catalog_meal_ids(self, restaurant_ids):
+        """mealIds the live catalog serves at these restaurants, so items dropped from a menu are removed"""
+        if not restaurant_ids:
+            return set()
+        return {meal['mealId'] for meal in self.get_recommender().meals
+                if meal.get('restaurantId') in restaurant_ids}
+
+    def sync_meals(self, meal_ids):
+        """Re-read meal_ids through the menu pipeline and apply them; returns (upserted, removed) counts"""
+        if not meal_ids:
+            return 0, 0
+        pipeline = build_menu_pipeline(self.campuses, meal_ids=meal_ids, sort=False)
+        upserts = list(aggregate_menu_items(self.db.restaurants, pipeline))
+        # Meals no longer on any campus menu (or without calories) leave the catalog
+        removed_ids = set(meal_ids) - {str(record['mealId']) for record in upserts}
+        self.apply_updates(upserts, removed_ids)
+        return len(upserts), len(removed_ids)
+
+    def sync_once(self):
+        """Apply everything changed since the previous sync"""
+        until = datetime.utcnow()
+        counts = self.sync_meals(self.changed_meal_ids(self.since, until))
+        self.since = until
+        return counts
+
+    def watch(self):
+        """Follow a change stream, applying the changed meals every interval seconds"""
+        pipeline = [{'$match': {'ns.coll': {'$in': ['meals', 'restaurants']}}}]
+        with self._open_stream(pipeline) as stream:
+            # Catch up on changes made before the stream opened, e.g. while it was reconnecting
+            self.sync_once()
+            pending = set()
+            restaurant_ids = set()
+            flush_at = time.monotonic() + self.interval
+            try:
+                while not self._stop.is_set():
+                    change = stream.try_next()
+                    self._resume_token = stream.resume_token
+                    if change is not None:
+                        document_id = str(change['documentKey']['_id'])
+                        if change['ns']['coll'] == 'meals':
+                            pending.add(document_id)
+                        else:
+                            restaurant_ids.add(document_id)
+                            pending.update(self._menu_meal_ids(change.get('fullDocument') or {}))
+                        continue
+                    if (pending or restaurant_ids) and time.monotonic() >= flush_at:
+                        self._flush(pending, restaurant_ids)
+                        flush_at = time.monotonic() + self.interval
+                    self._stop.wait(1)
+            finally:
+                # Changes already read from a failing stream are applied rather than dropped
+                if pending or restaurant_ids:
+                    self._flush(pending, restaurant_ids)
+
+    def _open_stream(self, pipeline):
+        """Open the change stream, resuming after the last change read when possible"""
+        if self._resume_token is not None:
+            try:
+                return self.db.watch(pipeline, full_document='updateLookup', resume_after=self._resume_token)
+            except OperationFailure:
+                # The token fell off the oplog; the catch-up sync covers the gap
+                self._resume_token = None
+        return self.db.watch(pipeline, full_document='updateLookup')
+
+    def _flush(self, pending, restaurant_ids):
+        """Apply streamed changes; a failed flush is retried by the next catch-up sync"""
+        until = datetime.utcnow()
+        self.sync_meals(pending | self._catalog_meal_ids(restaurant_ids))
+        pending.clear()
+        restaurant_ids.clear()
+        self.since = until
+
+    def run(self):
+        """Sync until stop() is called; errors are reported and retried on the next round"""
+        while not self._stop.is_set():
+            try:
+                if self.use_change_stream:
+                    self.watch()
+                else:
+                    self.sync_once()
+            except Exception as e:
+                print(f"Catalog sync failed: {str(e)}")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name='catalog-sync', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
@@ -1,75 +1,847 @@
 import json
+import copy
+import os
+import sys
 import numpy as np
+from scipy.sparse import csr_matrix, vstack
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 from collections import defaultdict
-import random
 from datetime import datetime
+from functools import lru_cache
+import multiprocessing
+from types import MappingProxyType
+import itertools
 from itertools import combinations
 import re
+from menu_files import open_menu_file, is_ndjson, iter_ndjson
+from meal_record import Meal, MealView
+
+# Macro percentage ranges for each weight goal
+GOAL_MACRO_RANGES = {
+    'maintain': {
+        'protein': {'min': 0.20, 'max': 0.30},  # 20-30%
+        'fat': {'min': 0.20, 'max': 0.35},      # 20-35%
+        'carbs': {'min': 0.40, 'max': 0.50}     # 40-50%
+    },
+    'lose': {
+        'protein': {'min': 0.30, 'max': 0.40},  # 30-40%
+        'fat': {'min': 0.20, 'max': 0.35},      # 20-35%
+        'carbs': {'min': 0.45, 'max': 0.55}     # 45-55%
+    },
+    'gain': {
+        'protein': {'min': 0.25, 'max': 0.35},  # 25-35%
+        'fat': {'min': 0.30, 'max': 0.40},      # 30-40%
+        'carbs': {'min': 0.45, 'max': 0.55}     # 45-55%
+    }
+}
+
+# Share of daily calories for each meal type in a weekly plan
+PLAN_MEAL_SPLIT = (
+    ('breakfast', 0.30),  # 30% of daily calories
+    ('lunch', 0.40),      # 40% of daily calories
+    ('dinner', 0.30)      # 30% of daily calories
+)
+
+def resolve_goal(goal, default):
+    """Goal name with a macro range table, falling back to default for unknown goals"""
+    return goal if goal in GOAL_MACRO_RANGES else default
+
+@lru_cache(maxsize=1024)
+def goal_profile(goal, target_calories, meal_split=None):
+    """Cached, read-only macro ranges and per-slot targets for a goal and daily calorie target"""
+    macro_ranges = GOAL_MACRO_RANGES[goal]
+    # meal_split holds (meal_type, share of daily calories) pairs; None splits evenly
+    if meal_split is None:
+        meal_split = tuple((meal_type, None) for meal_type in ('breakfast', 'lunch', 'dinner'))
+    
+    slots = {}
+    for meal_type, share in meal_split:
+        # An even split divides by the number of slots rather than multiplying by a rounded share
+        meal_calories = target_calories / len(meal_split) if share is None else target_calories * share
+        slots[meal_type] = MappingProxyType({
+            'calories': meal_calories,
+            'protein': (meal_calories * macro_ranges['protein']['min']) / 4,  # 4 calories per gram
+            'carbs': (meal_calories * macro_ranges['carbs']['min']) / 4,      # 4 calories per gram
+            'fat': (meal_calories * macro_ranges['fat']['min']) / 9,          # 9 calories per gram
+            # Solver bounds: multi-item meals land within 3% of the target, plan combinations within 10%
+            'calorie_ceiling': meal_calories * 1.03,
+            'calorie_floor': meal_calories * 0.97,
+            'calorie_window': (meal_calories - meal_calories * 0.1, meal_calories + meal_calories * 0.1)
+        })
+    
+    return MappingProxyType({
+        'goal': goal,
+        'macro_ranges': MappingProxyType({macro: MappingProxyType(bounds) for macro, bounds in macro_ranges.items()}),
+        'slots': MappingProxyType(slots)
+    })
+
+# Number of nearest neighbours kept per meal in the similarity index
+SIMILARITY_TOP_K = 20
+
+def top_k_neighbors(query_matrix, matrix, k, exclude=None, block_size=2 ** 22):
+    """Top-k cosine neighbours of each query row among the rows of matrix
+    
+    Rows of both sparse matrices must be L2-normalized, as TfidfVectorizer
+    output is, so cosine similarity is a plain dot product. Queries are
+    processed in chunks so memory stays linear in the catalog size.
+    exclude optionally gives, per query, a matrix row to leave out (itself).
+    block_size bounds the number of dense scores held at once.
+    Returns (indices, scores) arrays ordered best first.
+    """
+    num_queries = query_matrix.shape[0]
+    k = min(k, matrix.shape[0] - (1 if exclude is not None else 0))
+    indices = np.empty((num_queries, max(k, 0)), dtype=np.int32)
+    scores = np.empty((num_queries, max(k, 0)), dtype=np.float32)
+    if k <= 0:
+        return indices, scores
+    
+    matrix_t = matrix.T.tocsc()
+    chunk_size = max(1, block_size // matrix.shape[0])
+    for start in range(0, num_queries, chunk_size):
+        stop = min(start + chunk_size, num_queries)
+        block = (query_matrix[start:stop] @ matrix_t).toarray()
+        if exclude is not None:
+            block[np.arange(stop - start), exclude[start:stop]] = -np.inf
+        
+        # Partial selection of the k best, then order just those k
+        top = np.argpartition(block, -k, axis=1)[:, -k:]
+        top_scores = np.take_along_axis(block, top, axis=1)
+        order = np.lexsort((top, -top_scores), axis=1)
+        indices[start:stop] = np.take_along_axis(top, order, axis=1)
+        scores[start:stop] = np.take_along_axis(top_scores, order, axis=1)
+    return indices, scores
+
+def merge_neighbors(indices, scores, other_indices, other_scores, k):
+    """Merge two per-row neighbour lists into the k best, ordered like top_k_neighbors"""
+    indices = np.concatenate([indices, other_indices], axis=1)
+    scores = np.concatenate([scores, other_scores], axis=1)
+    order = np.lexsort((indices, -scores), axis=1)[:, :k]
+    return (np.take_along_axis(indices, order, axis=1).astype(np.int32),
+            np.take_along_axis(scores, order, axis=1).astype(np.float32))
+
+# Share of catalog rows with words the fitted TF-IDF vocabulary lacks before an update refits it
+VOCABULARY_DRIFT_THRESHOLD = 0.05
+
+def best_meal_combination(candidates, num_meals, nutrition, scores, target_calories, macro_ranges, floor, ceiling):
+    """Best num_meals combination of candidate positions for one meal slot
+    
+    nutrition is a (calories, protein, carbs, fat) tuple of lists indexed by
+    position and scores holds each position's individual score. floor and
+    ceiling are the slot's calorie bounds from its goal profile. Candidates
+    are searched in ascending calorie order, so a branch stops as soon as it
+    passes the ceiling and is skipped when even its heaviest completion
+    cannot reach the floor. Ties go to the combination that
+    itertools.combinations(candidates, num_meals) would have produced first.
+    Returns (combination_score, total_match_score, positions) or None.
+    """
+    calories, protein, carbs, fat = nutrition
+    # Pruning runs on reordered sums, so give it a little slack against rounding
+    slack = abs(target_calories) * 1e-9
+    
+    # Visit candidates lightest first; rank remembers each one's original place
+    ranks = sorted(range(len(candidates)), key=lambda rank: calories[candidates[rank]])
+    ordered_calories = [calories[candidates[rank]] for rank in ranks]
+    count = len(ranks)
+    
+    # heaviest[r] is the largest calorie total any r remaining candidates can add
+    heaviest = [0.0] * (num_meals + 1)
+    for r in range(1, num_meals + 1):
+        heaviest[r] = heaviest[r - 1] + (ordered_calories[count - r] if r <= count else 0.0)
+    
+    best = None
+    chosen = []
+    
+    def evaluate():
+        nonlocal best
+        # Re-add in original order so totals match a plain tuple-by-tuple scan exactly
+        combination = tuple(candidates[rank] for rank in sorted(chosen))
+        total_calories = 0
+        total_protein = 0
+        total_carbs = 0
+        total_fat = 0
+        for position in combination:
+            total_calories += calories[position]
+            total_protein += protein[position]
+            total_carbs += carbs[position]
+            total_fat += fat[position]
+        
+        if total_calories == 0 or total_calories > ceiling or total_calories < floor:
+            return
+        
+        # Skip combinations that don't meet macro requirements
+        protein_percent = (total_protein * 4 / total_calories)
+        carbs_percent = (total_carbs * 4 / total_calories)
+        fat_percent = (total_fat * 9 / total_calories)
+        if not (macro_ranges['protein']['min'] <= protein_percent <= macro_ranges['protein']['max'] and
+                macro_ranges['carbs']['min'] <= carbs_percent <= macro_ranges['carbs']['max'] and
+                macro_ranges['fat']['min'] <= fat_percent <= macro_ranges['fat']['max']):
+            return
+        
+        # Every macro is within range here, so each range score is 1.0
+        macro_score = 1.0
+        calorie_score = 1 - min(abs(total_calories - target_calories) / target_calories, 1)
+        
+        # Calculate total match score (70% macro match, 30% calorie match)
+        total_match_score = (macro_score * 0.7 + calorie_score * 0.3)
+        
+        # Calculate combination score (weighted average of individual scores and total match)
+        individual_scores = sum(scores[position] for position in combination) / num_meals
+        combination_score = (total_match_score * 0.8 + individual_scores * 0.2)
+        
+        key = tuple(sorted(chosen))
+        if best is None or combination_score > best[0] or (combination_score == best[0] and key < best[3]):
+            best = (combination_score, total_match_score, combination, key)
+    
+    def extend(start, total_calories):
+        remaining = num_meals - len(chosen)
+        if remaining == 0:
+            evaluate()
+            return
+        for i in range(start, count - remaining + 1):
+            # Lightest completion from here already over the ceiling: so is every later one
+            if total_calories + sum(ordered_calories[i:i + remaining]) > ceiling + slack:
+                break
+            # Heaviest completion still short of the floor
+            if total_calories + ordered_calories[i] + heaviest[remaining - 1] < floor - slack:
+                continue
+            chosen.append(ranks[i])
+            extend(i + 1, total_calories + ordered_calories[i])
+            chosen.pop()
+    
+    extend(0, 0.0)
+    return None if best is None else best[:3]
+
+def best_macro_combination(nutrition, target_calories, macro_ranges, calorie_window, max_items=5):
+    """Indices of the 1 to max_items meals closest to target_calories within calorie_window and macro_ranges, or None"""
+    # Ties go to the smaller subset, then the earlier one, as a combinations() scan by size would pick
+    calories, protein, carbs, fat = nutrition
+    count = len(calories)
+    max_items = min(max_items, count)
+    if max_items == 0:
+        return None
+    
+    low, high = calorie_window
+    slack = abs(target_calories) * 1e-9 + 1e-9
+    
+    # Each macro range as linear constraints (e.g. 4P - min * C >= 0); a valid subset sums to >= 0 on every one
+    constraints = []
+    for grams, calories_per_gram, macro in ((protein, 4, 'protein'), (carbs, 4, 'carbs'), (fat, 9, 'fat')):
+        constraints.append([grams[i] * calories_per_gram - macro_ranges[macro]['min'] * calories[i] for i in range(count)])
+        constraints.append([macro_ranges[macro]['max'] * calories[i] - grams[i] * calories_per_gram for i in range(count)])
+    # best_gain[c][r]: most any r further meals can add to constraint c
+    best_gain = []
+    for contributions in constraints:
+        gains = sorted((value for value in contributions if value > 0), reverse=True)
+        running = [0.0]
+        for r in range(max_items):
+            running.append(running[-1] + (gains[r] if r < len(gains) else 0.0))
+        best_gain.append(running)
+    
+    order = sorted(range(count), key=lambda i: calories[i])
+    ordered_calories = [calories[i] for i in order]
+    # heaviest[r]: most calories any r further meals can add
+    heaviest = [0.0]
+    for r in range(1, max_items + 1):
+        heaviest.append(heaviest[-1] + ordered_calories[count - r])
+    
+    best = None  # (score, size, indices)
+    chosen = []
+    
+    def evaluate():
+        nonlocal best
+        indices = tuple(sorted(chosen))
+        total_calories = sum(calories[i] for i in indices)
+        total_protein = sum(protein[i] for i in indices)
+        total_carbs = sum(carbs[i] for i in indices)
+        total_fat = sum(fat[i] for i in indices)
+        if total_calories == 0:
+            return
+        
+        protein_percent = (total_protein * 4 / total_calories)
+        carbs_percent = (total_carbs * 4 / total_calories)
+        fat_percent = (total_fat * 9 / total_calories)
+        if not (low <= total_calories <= high and
+                macro_ranges['protein']['min'] <= protein_percent <= macro_ranges['protein']['max'] and
+                macro_ranges['carbs']['min'] <= carbs_percent <= macro_ranges['carbs']['max'] and
+                macro_ranges['fat']['min'] <= fat_percent <= macro_ranges['fat']['max']):
+            return
+        
+        score = 1 - abs(total_calories - target_calories) / target_calories
+        if (best is None or score > best[0]
+                or (score == best[0] and (len(indices), indices) < (best[1], best[2]))):
+            best = (score, len(indices), indices)
+    
+    def extend(start, total_calories, totals):
+        if chosen:
+            evaluate()
+        remaining = max_items - len(chosen)
+        if remaining == 0:
+            return
+        # Nothing below can reach the calorie window or satisfy every macro range
+        if total_calories + heaviest[remaining] < low - slack:
+            return
+        if any(total + gains[remaining] < -slack for total, gains in zip(totals, best_gain)):
+            return
+        
+        for position in range(start, count):
+            new_calories = total_calories + ordered_calories[position]
+            # Meals are sorted by calories, so every later branch is heavier still
+            if new_calories > high + slack:
+                break
+            if best is not None:
+                # Past the target, later branches only drift further away
+                distance = new_calories - target_calories
+                if distance > 0 and 1 - distance / target_calories < best[0] - slack:
+                    break
+            meal = order[position]
+            chosen.append(meal)
+            extend(position + 1, new_calories, [total + contributions[meal] for total, contributions in zip(totals, constraints)])
+            chosen.pop()
+    
+    extend(0, 0.0, [0.0] * len(constraints))
+    return None if best is None else best[2]
+
+@lru_cache(maxsize=64)
+def combination_indices(count, size):
+    """All size-combinations of range(count) as a read-only (n, size) array, in itertools order"""
+    if size <= 3:
+        # Strictly increasing index grids; argwhere walks them in lexicographic order
+        grids = np.ix_(*[np.arange(count)] * size)
+        increasing = np.ones((count,) * size, dtype=bool)
+        for left, right in zip(grids, grids[1:]):
+            increasing &= left < right
+        indices = np.argwhere(increasing)
+    else:
+        indices = np.array(list(combinations(range(count), size)), dtype=np.intp).reshape(-1, size)
+    indices.setflags(write=False)
+    return indices
+
+def best_meal_combination_vectorized(candidates, num_meals, nutrition, scores, target_calories, macro_ranges,
+                                     floor, ceiling):
+    """Array version of best_meal_combination for small bundles
+    
+    nutrition is a (calories, protein, carbs, fat) tuple of arrays indexed by
+    position and scores an array of individual scores. Every combination's
+    totals are summed at once, the calorie window and macro ranges become
+    boolean masks, and argmax picks the first best combination in
+    itertools order, so the result matches best_meal_combination.
+    """
+    candidates = np.asarray(candidates)
+    # A candidate over the ceiling on its own can't be in any valid bundle; dropping it keeps the order
+    candidates = candidates[nutrition[0][candidates] <= ceiling]
+    combos = candidates[combination_indices(len(candidates), num_meals)]
+    if len(combos) == 0:
+        return None
+    
+    # Columns are added left to right, the order best_meal_combination sums in
+    totals = []
+    for values in nutrition + (scores,):
+        picked = values[combos]
+        total = picked[:, 0].copy()
+        for column in range(1, num_meals):
+            total += picked[:, column]
+        totals.append(total)
+    total_calories, total_protein, total_carbs, total_fat, total_scores = totals
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        protein_percent = total_protein * 4 / total_calories
+        carbs_percent = total_carbs * 4 / total_calories
+        fat_percent = total_fat * 9 / total_calories
+    
+    valid = ((total_calories != 0)
+             & (total_calories <= ceiling)
+             & (total_calories >= floor)
+             & (protein_percent >= macro_ranges['protein']['min']) & (protein_percent <= macro_ranges['protein']['max'])
+             & (carbs_percent >= macro_ranges['carbs']['min']) & (carbs_percent <= macro_ranges['carbs']['max'])
+             & (fat_percent >= macro_ranges['fat']['min']) & (fat_percent <= macro_ranges['fat']['max']))
+    valid_rows = np.flatnonzero(valid)
+    if len(valid_rows) == 0:
+        return None
+    
+    # Every macro is within range for valid rows, so the macro score is 1.0
+    calorie_score = 1 - np.minimum(np.abs(total_calories[valid_rows] - target_calories) / target_calories, 1)
+    total_match_score = 1.0 * 0.7 + calorie_score * 0.3
+    combination_score = total_match_score * 0.8 + total_scores[valid_rows] / num_meals * 0.2
+    
+    best = int(np.argmax(combination_score))
+    return (float(combination_score[best]), float(total_match_score[best]),
+            tuple(combos[valid_rows[best]].tolist()))
+
+# Name patterns that make two meals count as similar when both names contain one
+SIMILARITY_PATTERNS = ('nugget', 'burger', 'sandwich', 'salad', 'pizza', 'pasta', 'rice', 'chicken', 'beef', 'fish')
+
+def similarity_features(meal):
+    """(name word set, ingredient set, pattern bitmask) used to compare meals"""
+    # Convert to lowercase for comparison
+    name = meal['mealName'].lower()
+    name_tokens = frozenset(name.split())
+    ingredients = frozenset(ing.lower() for ing in meal.get('ingredients', []))
+    patterns = 0
+    for bit, pattern in enumerate(SIMILARITY_PATTERNS):
+        if pattern in name:
+            patterns |= 1 << bit
+    return name_tokens, ingredients, patterns
+
+def token_matrix(token_sets):
+    """Binary sparse matrix with a row per token set and a column per distinct token"""
+    vocabulary = {}
+    indices = []
+    indptr = [0]
+    for tokens in token_sets:
+        for token in tokens:
+            indices.append(vocabulary.setdefault(token, len(vocabulary)))
+        indptr.append(len(indices))
+    return csr_matrix((np.ones(len(indices), dtype=np.int32), indices, indptr),
+                      shape=(len(token_sets), len(vocabulary)))
+
+def similar_features(features1, features2):
+    """Compare two similarity_features tuples"""
+    name_tokens1, ingredients1, patterns1 = features1
+    name_tokens2, ingredients2, patterns2 = features2
+    # If 2 or more common words in names, likely similar
+    if len(name_tokens1 & name_tokens2) >= 2:
+        return True
+    # If 3 or more common ingredients
+    if len(ingredients1 & ingredients2) >= 3:
+        return True
+    # Check for specific patterns in both names
+    return bool(patterns1 & patterns2)
+
+def plan_context_key(preferences):
+    """Preferences that determine a meal plan; equal keys give equal plans"""
+    # Define macro ranges based on goal; unknown goals plan as gain
+    goal = resolve_goal(preferences.get('goal', 'maintain').lower(), 'gain')
+    
+    # Get target calories from preferences
+    target_calories = preferences.get('target_calories')
+    if target_calories is None:
+        raise ValueError("Target calories must be provided in preferences")
+    return goal, target_calories
+
+def copy_meal_plan(meal_plan):
+    """Copy a meal plan's days and meal lists so callers can edit them independently"""
+    return [
+        dict(day, meals_by_type={meal_type: list(meals) for meal_type, meals in day['meals_by_type'].items()})
+        for day in meal_plan
+    ]
+
+def pack_meal_plan(meal_plan):
+    """Meal plan with each MealView reduced to its (row, annotations), for sending between processes"""
+    return [
+        dict(day, meals_by_type={meal_type: [(meal.row, meal.annotations) for meal in meals]
+                                 for meal_type, meals in day['meals_by_type'].items()})
+        for day in meal_plan
+    ]
+
+def unpack_meal_plan(packed_plan, meals):
+    """Rebuild a pack_meal_plan() result against the catalog meals it was planned from"""
+    return [
+        dict(day, meals_by_type={meal_type: [MealView(meals[row], row, annotations) for row, annotations in rows]
+                                 for meal_type, rows in day['meals_by_type'].items()})
+        for day in packed_plan
+    ]
+
+def build_plan_outcome(recommender, preferences):
+    """Build one meal plan as ('success', plan) or ('error', message)"""
+    try:
+        return 'success', recommender._build_meal_plan(recommender.prepare_plan_context(preferences))
+    except Exception as e:
+        return 'error', str(e)
+
+# Catalog of a plan worker: inherited from a forked parent, or loaded from _worker_snapshot
+_worker_recommender = None
+_worker_snapshot = None
+
+def _init_plan_worker(recommender):
+    global _worker_recommender
+    _worker_recommender = recommender
+
+def _load_worker_snapshot(snapshot_path):
+    global _worker_recommender, _worker_snapshot
+    if snapshot_path != _worker_snapshot:
+        # Snapshot arrays are memory-mapped, so all workers share their pages
+        _worker_recommender = MealRecommender.from_snapshot(snapshot_path)
+        _worker_snapshot = snapshot_path
+
+def _plan_worker(task):
+    snapshot_path, preferences = task
+    if snapshot_path is not None:
+        _load_worker_snapshot(snapshot_path)
+    # Only rows and annotations travel back; the parent already holds the same catalog
+    status, value = build_plan_outcome(_worker_recommender, preferences)
+    return status, pack_meal_plan(value) if status == 'success' else value
+
+class PlanWorkerPool:
+    """Long-lived plan worker processes that load the catalog from a snapshot"""
+    def __init__(self, workers):
+        # Workers come from a clean forkserver (or spawn) process, never from forking a threaded server
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('forkserver')
+            context.set_forkserver_preload(['meal_recommender'])
+        else:
+            context = multiprocessing.get_context('spawn')
+        self.workers = workers
+        self._catalog = None
+        self._pool = context.Pool(workers)
+    
+    def use_snapshot(self, recommender, snapshot_path):
+        """Plan recommender's requests from snapshot_path, which must hold the same catalog"""
+        self._catalog = (recommender, snapshot_path)
+        # Start loading it now so the next batch does not wait for it
+        self._pool.map_async(_load_worker_snapshot, [snapshot_path] * self.workers, chunksize=1)
+    
+    def map(self, recommender, preferences):
+        """Packed outcomes, one per preferences dict, or None when the workers hold another catalog"""
+        catalog = self._catalog
+        if catalog is None or catalog[0] is not recommender:
+            return None
+        return self._pool.map(_plan_worker, [(catalog[1], preference) for preference in preferences])
+    
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+def encode_column(values):
+    """Encode a sequence of labels as integer codes, labels kept in first-seen order"""
+    labels = []
+    lookup = {}
+    codes = np.empty(len(values), dtype=np.int32)
+    for i, value in enumerate(values):
+        code = lookup.get(value)
+        if code is None:
+            code = lookup[value] = len(labels)
+            labels.append(value)
+        codes[i] = code
+    return labels, codes
+
+def pack_lists(lists):
+    """Flatten lists into (labels, codes, offsets); row i holds codes[offsets[i]:offsets[i + 1]]"""
+    lists = list(lists)
+    labels, codes = encode_column([value for values in lists for value in values])
+    offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(values) for values in lists])
+    return labels, codes, offsets
+
+def unpack_lists(labels, codes, offsets, container=list):
+    """Inverse of pack_lists, building each row with container"""
+    label_array = np.empty(len(labels), dtype=object)
+    label_array[:] = labels
+    values = label_array[codes].tolist()
+    offsets = offsets.tolist()
+    return [container(values[start:stop]) for start, stop in zip(offsets, offsets[1:])]
+
+def intern_labels(labels):
+    """Intern the strings of a snapshot string table so equal values share one object"""
+    return [sys.intern(label) if isinstance(label, str) else label for label in labels]
+
+def lists_matrix(codes, offsets, num_labels):
+    """Binary sparse row x label matrix of packed lists, as token_matrix builds it"""
+    return csr_matrix((np.ones(len(codes), dtype=np.int32), codes, offsets), shape=(len(offsets) - 1, num_labels))
+
+# Bump when the snapshot layout changes; older snapshots are refused rather than misread
+SNAPSHOT_FORMAT = 2
+
+# Per-row nutrition arrays built by build_catalog_arrays(), stored as-is in snapshots
+CATALOG_ARRAYS = (
+    'meal_calories', 'meal_protein', 'meal_carbohydrate', 'meal_fat', 'portion_multipliers',
+    'portioned_calories', 'portioned_protein', 'portioned_carbohydrate', 'portioned_fat'
+)
+
+# Encoded columns kept as <name>_labels and <name>_codes attributes
+CATALOG_COLUMNS = ('restaurant', 'category', 'meal_type', 'meal_id', 'meal_name')
+
+def parse_portion_multiplier(serving):
+    """Fraction of a serving that makes up one portion (catering trays serve many)"""
+    serving = (serving or '').lower()
+    # Check if this is a catering/tray meal
+    if 'tray' in serving or 'container' in serving or 'serves' in serving:
+        # Try to extract number of servings
+        serves_match = re.search(r'serves\s*(\d+)', serving)
+        if serves_match:
+            return 1.0 / float(serves_match.group(1))
+        # Default to 10 servings if not specified
+        return 0.1
+    return 1.0
+
+def macro_range_scores(percent, macro_range):
+    """Score macro percentages against a min/max range: 1.0 inside, falling off outside"""
+    low = macro_range['min']
+    high = macro_range['max']
+    return np.where(percent < low, percent / low,
+                    np.where(percent > high, 1 - (percent - high) / (1 - high), 1.0))
+
+# Every catalog build gets a new version so cached plans from older menus are never reused
+_catalog_versions = itertools.count(1)
 
 class MealRecommender:
-    def __init__(self, json_file):
+    def __init__(self, json_file, min_calories=None):
+        """Load the menu from a JSON array file or a newline-delimited (.ndjson/.jsonl) one
+        
+        Either may be gzip-compressed (.gz). Newline-delimited records are
+        parsed one line at a time as they are normalized, and meals below
+        min_calories are dropped before any work is done on them.
+        """
+        menu_file = None
         try:
-            with open(json_file, 'r') as f:
-                self.meals = json.load(f)
-            
-            # Define meal options by category
-            self.meal_options = {
-                'breakfast': ['starbucks', 'jamba juice', 'village juice', 'taco bell'],
-                'lunch': ['barberitos', 'qdoba', 'saladworks', 'bojangles'],
-                'dinner': ['subway', 'chick-fil-a', 'panera bread', 'panda express']
-            }
-            
-            # Initialize user preferences
-            self.user_preferences = {
-                'target_calories': 2000,  # Default value
-                'goal': 'maintain',
-                'allergies': [],
-                'exercise': 'Regular exercise',
-                'preferred_locations': [],
-                'novelty_factor': 0.5,
-                'dietary_restrictions': []
-            }
-            
-            # Ensure all meals have required fields
-            for meal in self.meals:
-                meal['mealName'] = meal.get('mealName', 'Unnamed Meal')
-                meal['restaurantName'] = meal.get('restaurantName', 'Unknown Restaurant')
-                meal['calories'] = float(meal.get('calories', 0))
-                meal['protein'] = float(meal.get('protein', 0))
-                meal['carbohydrate'] = float(meal.get('carbohydrate', 0))
-                meal['fat'] = float(meal.get('fat', 0))
-                
-                # Get original meal type or set to Unknown if not present
-                original_type = meal.get('mealType', 'Unknown')
-                
-                # If meal type is Unknown, try to determine it from restaurant name
-                if original_type.lower() == 'unknown':
-                    restaurant_name = meal.get('restaurantName', '').lower()
-                    for category, restaurants in self.meal_options.items():
-                        if any(restaurant.lower() in restaurant_name for restaurant in restaurants):
-                            meal['mealType'] = category
-                            break
-                    else:
-                        # If no match found, keep it as Unknown
-                        meal['mealType'] = original_type
-                else:
-                    # Keep the original meal type
-                    meal['mealType'] = original_type
-                
+            menu_file = open_menu_file(json_file)
+            if is_ndjson(json_file):
+                records = iter_ndjson(menu_file)
+            else:
+                records = json.load(menu_file)
         except FileNotFoundError:
             print(f"Error: Could not find the meal data file ({json_file})")
-            self.meals = []
+            records = []
         except json.JSONDecodeError:
             print(f"Error: Invalid JSON format in the meal data file ({json_file})")
+            records = []
+        except Exception as e:
+            print(f"Error loading meal data: {str(e)}")
+            records = []
+        
+        try:
+            self._initialize(records, min_calories)
+        finally:
+            if menu_file is not None:
+                menu_file.close()
+    
+    @classmethod
+    def from_records(cls, records, min_calories=None):
+        """Build a recommender directly from menu records, e.g. a pymongo cursor"""
+        recommender = cls.__new__(cls)
+        recommender._initialize(records, min_calories)
+        return recommender
+    
+    def export_snapshot(self, path, read_at=None):
+        """Write the catalog and its fitted models to the snapshot directory path
+        
+        read_at is the UTC time the menu was read from MongoDB; it is stored
+        as created_at so a sync started from the snapshot replays any edits
+        made while it was being compiled. It defaults to now.
+        
+        Nutrition columns, field codes and the TF-IDF, token and neighbour
+        matrices are stored as .npy files. Field values go into per-field
+        string tables (strings.json), so a restaurant name or ingredient
+        is stored once however many meals use it. manifest.json is
+        written last and marks the snapshot complete.
+        """
+        os.makedirs(path, exist_ok=True)
+        arrays = {}
+        tables = {}
+        fields = []
+        for field in dict.fromkeys(key for meal in self.meals for key in meal):
+            # Fields may be missing from some meals; only present values are stored
+            arrays[field + '.present'] = np.array([field in meal for meal in self.meals], dtype=bool)
+            values = [meal[field] for meal in self.meals if field in meal]
+            if all(type(value) is float for value in values):
+                kind = 'float'
+                arrays[field] = np.array(values, dtype=np.float64)
+            elif all(isinstance(value, (list, tuple)) for value in values):
+                kind = 'list'
+                tables[field], arrays[field + '.codes'], arrays[field + '.offsets'] = pack_lists(values)
+            else:
+                try:
+                    kind = 'value'
+                    tables[field], arrays[field + '.codes'] = encode_column(values)
+                except TypeError:
+                    # Unhashable values are kept per meal without interning
+                    kind = 'json'
+                    tables[field] = values
+            fields.append([field, kind])
+        
+        # Catalog arrays, encoded columns and candidate groups are stored ready to map
+        for name in CATALOG_ARRAYS:
+            arrays['catalog.' + name] = getattr(self, name)
+        for name in CATALOG_COLUMNS:
+            tables['column.' + name] = getattr(self, name + '_labels')
+            arrays['column.' + name + '.codes'] = getattr(self, name + '_codes')
+        groups = [(category, meal_type, restaurant, rows)
+                  for (category, meal_type), restaurants in self.candidate_index.items()
+                  for restaurant, rows in restaurants.items()]
+        tables['candidate_groups'] = [list(group[:3]) for group in groups]
+        arrays['candidate_index.rows'] = np.concatenate([rows for *_, rows in groups] or [np.empty(0, dtype=np.intp)])
+        arrays['candidate_index.offsets'] = np.cumsum([0] + [len(rows) for *_, rows in groups], dtype=np.int64)
+        
+        tables['name_tokens'], arrays['name_tokens.codes'], arrays['name_tokens.offsets'] = pack_lists(self.name_token_sets)
+        tables['ingredients_lower'], arrays['ingredients_lower.codes'], arrays['ingredients_lower.offsets'] = \
+            pack_lists(self.ingredient_sets)
+        arrays['pattern_masks'] = self.pattern_masks
+        
+        vocabulary = self.vectorizer.vocabulary_
+        tables['vocabulary'] = sorted(vocabulary, key=vocabulary.get)
+        arrays['tfidf.idf'] = self.vectorizer.idf_
+        arrays['tfidf.data'] = self.tfidf_matrix.data
+        arrays['tfidf.indices'] = self.tfidf_matrix.indices
+        arrays['tfidf.indptr'] = self.tfidf_matrix.indptr
+        arrays['neighbors.indices'] = self.neighbor_indices
+        arrays['neighbors.scores'] = self.neighbor_scores
+        arrays['stale_rows'] = self.stale_rows
+        
+        for name, array in arrays.items():
+            np.save(os.path.join(path, name + '.npy'), np.ascontiguousarray(array))
+        with open(os.path.join(path, 'strings.json'), 'w', encoding='utf-8') as f:
+            json.dump(tables, f, default=str, ensure_ascii=False)
+        with open(os.path.join(path, 'manifest.json'), 'w') as f:
+            json.dump({
+                'format': SNAPSHOT_FORMAT,
+                'created_at': (read_at or datetime.utcnow()).isoformat(),
+                'count': len(self.meals),
+                'fields': fields,
+                'stop_words': self.vectorizer.stop_words
+            }, f, indent=2)
+    
+    @classmethod
+    def from_snapshot(cls, path):
+        """Load a recommender written by export_snapshot()
+        
+        The catalog, candidate, TF-IDF and neighbour arrays are memory-mapped
+        read-only and used as they are, so nothing is refitted and processes
+        that load the same snapshot share their pages. Only the meal records
+        and Python-level sets are rebuilt per process.
+        """
+        with open(os.path.join(path, 'manifest.json')) as f:
+            manifest = json.load(f)
+        if manifest.get('format') != SNAPSHOT_FORMAT:
+            raise ValueError(f"Unsupported catalog snapshot format: {manifest.get('format')}")
+        with open(os.path.join(path, 'strings.json'), encoding='utf-8') as f:
+            tables = json.load(f)
+        
+        def load(name):
+            return np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+        
+        count = manifest['count']
+        meals = [{} for _ in range(count)]
+        for field, kind in manifest['fields']:
+            if kind == 'float':
+                values = load(field).tolist()
+            elif kind == 'list':
+                values = unpack_lists(intern_labels(tables[field]), load(field + '.codes'), load(field + '.offsets'))
+            elif kind == 'value':
+                labels = intern_labels(tables[field])
+                values = [labels[code] for code in load(field + '.codes').tolist()]
+            else:
+                values = tables[field]
+            for row, value in zip(np.flatnonzero(load(field + '.present')).tolist(), values):
+                meals[row][field] = value
+        meals = [Meal(meal) for meal in meals]
+        
+        recommender = cls.__new__(cls)
+        recommender._initialize_settings()
+        recommender.meals = meals
+        columns = {name: (intern_labels(tables['column.' + name]), load('column.' + name + '.codes'))
+                   for name in CATALOG_COLUMNS}
+        recommender.build_catalog_arrays({name: load('catalog.' + name) for name in CATALOG_ARRAYS}, columns)
+        
+        candidate_rows = load('candidate_index.rows')
+        offsets = load('candidate_index.offsets').tolist()
+        candidate_index = {}
+        for (category, meal_type, restaurant), start, stop in zip(tables['candidate_groups'], offsets, offsets[1:]):
+            candidate_index.setdefault((category, meal_type), {})[restaurant] = candidate_rows[start:stop]
+        recommender.build_candidate_index(columns, candidate_index)
+        
+        name_tokens = (tables['name_tokens'], load('name_tokens.codes'), load('name_tokens.offsets'))
+        ingredients = (tables['ingredients_lower'], load('ingredients_lower.codes'), load('ingredients_lower.offsets'))
+        pattern_masks = load('pattern_masks')
+        recommender.build_similarity_features(
+            list(zip(unpack_lists(*name_tokens, frozenset), unpack_lists(*ingredients, frozenset),
+                     pattern_masks.tolist())),
+            (lists_matrix(name_tokens[1], name_tokens[2], len(name_tokens[0])),
+             lists_matrix(ingredients[1], ingredients[2], len(ingredients[0]))),
+            pattern_masks)
+        
+        # The fitted vectorizer is rebuilt from its vocabulary and idf weights
+        recommender.vectorizer = TfidfVectorizer(stop_words=manifest['stop_words'])
+        recommender.vectorizer.vocabulary_ = {token: column for column, token in enumerate(tables['vocabulary'])}
+        recommender.vectorizer.idf_ = np.array(load('tfidf.idf'))
+        recommender.tfidf_matrix = csr_matrix(
+            (load('tfidf.data'), load('tfidf.indices'), load('tfidf.indptr')),
+            shape=(count, len(tables['vocabulary'])))
+        recommender.neighbor_indices = load('neighbors.indices')
+        recommender.neighbor_scores = load('neighbors.scores')
+        recommender.stale_rows = load('stale_rows')
+        recommender.catalog_version = next(_catalog_versions)
+        recommender.snapshot_created_at = datetime.fromisoformat(manifest['created_at'])
+        recommender.snapshot_path = path
+        return recommender
+    
+    def _initialize_settings(self):
+        """Default meal options and user preferences"""
+        # Define meal options by category
+        self.meal_options = {
+            'breakfast': ['starbucks', 'jamba juice', 'village juice', 'taco bell'],
+            'lunch': ['barberitos', 'qdoba', 'saladworks', 'bojangles'],
+            'dinner': ['subway', 'chick-fil-a', 'panera bread', 'panda express']
+        }
+        
+        # Initialize user preferences
+        self.user_preferences = {
+            'target_calories': 2000,  # Default value
+            'goal': 'maintain',
+            'allergies': [],
+            'exercise': 'Regular exercise',
+            'preferred_locations': [],
+            'novelty_factor': 0.5,
+            'dietary_restrictions': []
+        }
+    
+    def _initialize(self, records, min_calories=None):
+        """Normalize menu records and build the models
+        
+        Records below min_calories are skipped before they are normalized.
+        """
+        self._initialize_settings()
+        
+        try:
+            # Filter, normalize and featurize each record as it is read, so cursors and files take a single pass
             self.meals = []
+            for record in records:
+                if min_calories is not None and float(record.get('calories') or 0) < min_calories:
+                    continue
+                # Normalize a copy; the Meal keeps its own fields and the caller's record is left as given
+                meal = self._normalize_meal(dict(record))
+                self._preprocess_meal(meal)
+                self.meals.append(Meal(meal))
         except Exception as e:
             print(f"Error loading meal data: {str(e)}")
             self.meals = []
         
-        self.preprocess_data()
+        self.build_catalog_arrays()
+        self.build_candidate_index()
+        self.build_similarity_features()
         self.initialize_models()
+        self.catalog_version = next(_catalog_versions)
+    
+    def _normalize_meal(self, meal):
+        """Ensure a menu record has all required fields"""
+        # Mongo documents carry ObjectIds; store them as strings like the JSON export does
+        for field in ('_id', 'restaurantId', 'mealId'):
+            if field in meal and meal[field] is not None and not isinstance(meal[field], str):
+                meal[field] = str(meal[field])
+        
+        meal['mealName'] = meal.get('mealName', 'Unnamed Meal')
+        meal['restaurantName'] = meal.get('restaurantName', 'Unknown Restaurant')
+        meal['calories'] = float(meal.get('calories', 0))
+        meal['protein'] = float(meal.get('protein', 0))
+        meal['carbohydrate'] = float(meal.get('carbohydrate', 0))
+        meal['fat'] = float(meal.get('fat', 0))
+        
+        # Get original meal type or set to Unknown if not present
+        original_type = meal.get('mealType', 'Unknown')
+        
+        # If meal type is Unknown, try to determine it from restaurant name
+        if original_type.lower() == 'unknown':
+            restaurant_name = meal.get('restaurantName', '').lower()
+            for category, restaurants in self.meal_options.items():
+                if any(restaurant.lower() in restaurant_name for restaurant in restaurants):
+                    meal['mealType'] = category
+                    break
+            else:
+                # If no match found, keep it as Unknown
+                meal['mealType'] = original_type
+        else:
+            # Keep the original meal type
+            meal['mealType'] = original_type
+        
+        return meal
         
     def load_data(self, json_file):
         """Load and parse the JSON data"""
@@ -100,27 +872,140 @@ class MealRecommender:
     
     def preprocess_data(self):
         """Prepare data for analysis"""
-        for meal in self.meals:
-            # Create a feature string combining important attributes
-            features = []
-            features.append(meal['mealName'])
-            features.extend(meal.get('ingredients', []))
-            features.extend(meal.get('allergens', []))
-            features.append(meal['mealType'])
-            features.append(meal['category'])
-            meal['feature_string'] = ' '.join(features).lower()
-            
-            # Calculate health score (simplified)
-            protein = meal.get('protein', 0)
-            fat = meal.get('fat', 0)
-            carbs = meal.get('carbohydrate', 0)
-            calories = meal.get('calories', 0)
-            
-            # Simple health score (higher is better)
-            if calories > 0:
-                meal['health_score'] = (protein * 0.5 + (1000 / calories) * 0.3 - fat * 0.1 - carbs * 0.1)
-            else:
-                meal['health_score'] = 0
+        self.meals = [Meal(self._preprocess_meal(dict(meal))) for meal in self.meals]
+    
+    def _preprocess_meal(self, meal):
+        """Derive the feature string, health score and portion size of a meal record, in place"""
+        # Create a feature string combining important attributes
+        features = []
+        features.append(meal['mealName'])
+        features.extend(meal.get('ingredients', []))
+        features.extend(meal.get('allergens', []))
+        features.append(meal['mealType'])
+        features.append(meal['category'])
+        meal['feature_string'] = ' '.join(features).lower()
+        
+        # Calculate health score (simplified)
+        protein = meal.get('protein', 0)
+        fat = meal.get('fat', 0)
+        carbs = meal.get('carbohydrate', 0)
+        calories = meal.get('calories', 0)
+        
+        # Simple health score (higher is better)
+        if calories > 0:
+            meal['health_score'] = (protein * 0.5 + (1000 / calories) * 0.3 - fat * 0.1 - carbs * 0.1)
+        else:
+            meal['health_score'] = 0
+        
+        # Parse the serving text once; catering trays are scaled down to one portion
+        meal['portion_multiplier'] = parse_portion_multiplier(meal.get('serving', ''))
+        return meal
+    
+    def build_catalog_arrays(self, arrays=None, columns=None):
+        """Store nutrition as contiguous arrays and categorical fields as integer codes
+        
+        arrays (name -> array, see CATALOG_ARRAYS) and columns (name ->
+        (labels, codes), see CATALOG_COLUMNS) optionally supply them already
+        built, e.g. memory-mapped from a snapshot, instead of deriving them
+        from the meals.
+        """
+        # mealId -> catalog row; a mealId served at several restaurants maps to its first row
+        self.meal_index = {}
+        for row, meal in enumerate(self.meals):
+            self.meal_index.setdefault(meal.get('mealId'), row)
+        
+        if arrays is not None:
+            for name in CATALOG_ARRAYS:
+                setattr(self, name, arrays[name])
+            for name in ('restaurant', 'category', 'meal_type'):
+                setattr(self, name + '_labels', columns[name][0])
+                setattr(self, name + '_codes', columns[name][1])
+            return
+        
+        count = len(self.meals)
+        self.meal_calories = np.fromiter((meal['calories'] for meal in self.meals), dtype=np.float64, count=count)
+        self.meal_protein = np.fromiter((meal['protein'] for meal in self.meals), dtype=np.float64, count=count)
+        self.meal_carbohydrate = np.fromiter((meal['carbohydrate'] for meal in self.meals), dtype=np.float64, count=count)
+        self.meal_fat = np.fromiter((meal['fat'] for meal in self.meals), dtype=np.float64, count=count)
+        
+        # Single-portion nutrition, so requests never look at the serving text again
+        self.portion_multipliers = np.fromiter(
+            (meal['portion_multiplier'] for meal in self.meals), dtype=np.float64, count=count)
+        self.portioned_calories = self.meal_calories * self.portion_multipliers
+        self.portioned_protein = self.meal_protein * self.portion_multipliers
+        self.portioned_carbohydrate = self.meal_carbohydrate * self.portion_multipliers
+        self.portioned_fat = self.meal_fat * self.portion_multipliers
+        
+        # Row i of every array describes self.meals[i]; labels are in first-seen catalog order
+        self.restaurant_labels, self.restaurant_codes = encode_column(
+            [meal['restaurantName'] for meal in self.meals])
+        self.category_labels, self.category_codes = encode_column(
+            [meal.get('category') for meal in self.meals])
+        # Meal types are compared case-insensitively everywhere, so encode them lowercased
+        self.meal_type_labels, self.meal_type_codes = encode_column(
+            [meal['mealType'].lower() for meal in self.meals])
+    
+    def build_candidate_index(self, columns=None, candidate_index=None):
+        """Group catalog rows by (category, mealType, restaurant) for plan building
+        
+        Each group holds its rows sorted by protein, highest first, with ties
+        in catalog order. Restaurants keep their first-seen catalog order.
+        columns (with 'meal_id' and 'meal_name' entries) and candidate_index
+        optionally supply the result already built.
+        """
+        if candidate_index is not None:
+            self.meal_id_labels, self.meal_id_codes = columns['meal_id']
+            self.meal_name_labels, self.meal_name_codes = columns['meal_name']
+            self.candidate_index = candidate_index
+            return
+        
+        self.meal_id_labels, self.meal_id_codes = encode_column([meal.get('mealId') for meal in self.meals])
+        self.meal_name_labels, self.meal_name_codes = encode_column([meal['mealName'] for meal in self.meals])
+        
+        grouped = defaultdict(lambda: defaultdict(list))
+        for row, meal in enumerate(self.meals):
+            key = (meal.get('category'), self.meal_type_labels[self.meal_type_codes[row]])
+            grouped[key][meal['restaurantName']].append(row)
+        
+        self.candidate_index = {}
+        for key, restaurants in grouped.items():
+            self.candidate_index[key] = {}
+            for restaurant, rows in restaurants.items():
+                rows = np.array(rows, dtype=np.intp)
+                order = np.lexsort((rows, -self.meal_protein[rows]))
+                self.candidate_index[key][restaurant] = rows[order]
+    
+    def _available_candidates(self, category, meal_type, candidates, used_ids, used_names=None, used_restaurants=()):
+        """Unused candidate rows for a plan slot as (restaurant, rows, available) triples
+        
+        Restaurants with no unused meals are omitted; the rest come in order
+        of their first unused catalog row. available counts every unused meal
+        of the restaurant, while rows keeps only those in the slot's
+        prepared candidates, in protein order.
+        """
+        groups = []
+        slot_candidates = candidates.get((category, meal_type), {})
+        for restaurant, rows in self.candidate_index.get((category, meal_type), {}).items():
+            if restaurant in used_restaurants:
+                continue
+            unused = self._unused_rows(rows, used_ids, used_names)
+            if len(unused):
+                groups.append((restaurant, self._unused_rows(slot_candidates[restaurant], used_ids, used_names),
+                               len(unused), unused.min()))
+        groups.sort(key=lambda group: group[3])
+        return [group[:3] for group in groups]
+    
+    def _unused_rows(self, rows, used_ids, used_names=None):
+        """Rows whose mealId (and optionally name) is not used yet"""
+        available = ~used_ids[self.meal_id_codes[rows]]
+        if used_names is not None:
+            available &= ~used_names[self.meal_name_codes[rows]]
+        return rows[available]
+    
+    def meal_type_mask(self, meal_time):
+        """Boolean mask of catalog rows whose meal type mentions meal_time"""
+        matching = [code for code, label in enumerate(self.meal_type_labels) if meal_time.lower() in label]
+        return np.isin(self.meal_type_codes, matching)
     
     def initialize_models(self):
         """Initialize ML models for recommendations"""
@@ -129,8 +1014,86 @@ class MealRecommender:
         feature_strings = [meal['feature_string'] for meal in self.meals]
         self.tfidf_matrix = self.vectorizer.fit_transform(feature_strings)
         
-        # Calculate similarity matrix
-        self.similarity_matrix = cosine_similarity(self.tfidf_matrix)
+        # Keep only each meal's nearest neighbours instead of a dense N x N similarity matrix
+        self.neighbor_indices, self.neighbor_scores = top_k_neighbors(
+            self.tfidf_matrix, self.tfidf_matrix, SIMILARITY_TOP_K,
+            exclude=np.arange(self.tfidf_matrix.shape[0]))
+        
+        # Rows added later by with_updates() whose words the fitted vocabulary lacks
+        self.stale_rows = np.zeros(len(self.meals), dtype=bool)
+    
+    def with_updates(self, upserts=(), removed_ids=()):
+        """New recommender with meals added, replaced or removed by mealId; this one is left untouched"""
+        # Rows of changed mealIds are dropped and the upserted records appended
+        new_meals = []
+        for record in upserts:
+            meal = self._normalize_meal(dict(record))
+            if meal.get('mealId') is None:
+                raise ValueError("Upserted meals must have a mealId")
+            self._preprocess_meal(meal)
+            new_meals.append(Meal(meal))
+        changed_ids = {meal['mealId'] for meal in new_meals}
+        changed_ids.update(str(meal_id) for meal_id in removed_ids)
+        
+        keep = np.fromiter((meal.get('mealId') not in changed_ids for meal in self.meals),
+                           dtype=bool, count=len(self.meals))
+        kept_rows = np.flatnonzero(keep)
+        
+        updated = copy.copy(self)
+        updated.meals = [self.meals[row] for row in kept_rows] + new_meals
+        updated.build_catalog_arrays()
+        updated.build_candidate_index()
+        updated.build_similarity_features(
+            [(self.name_token_sets[row], self.ingredient_sets[row], self.pattern_bits[row]) for row in kept_rows]
+            + [similarity_features(meal) for meal in new_meals])
+        updated.catalog_version = next(_catalog_versions)
+        # The updated catalog no longer matches the snapshot this one may have come from
+        updated.snapshot_path = None
+        
+        # Words outside the fitted vocabulary are invisible to transform(); refit once too many rows have them
+        vocabulary = self.vectorizer.vocabulary_
+        analyzer = self.vectorizer.build_analyzer()
+        new_stale = np.array([any(token not in vocabulary for token in analyzer(meal['feature_string']))
+                              for meal in new_meals], dtype=bool)
+        updated.stale_rows = np.concatenate([self.stale_rows[kept_rows], new_stale])
+        if not len(kept_rows) or updated.stale_rows.mean() > VOCABULARY_DRIFT_THRESHOLD:
+            updated.initialize_models()
+            return updated
+        
+        # Only the new rows go through the fitted vectorizer
+        new_matrix = (self.vectorizer.transform([meal['feature_string'] for meal in new_meals])
+                      if new_meals else self.tfidf_matrix[:0])
+        updated.tfidf_matrix = vstack([self.tfidf_matrix[kept_rows], new_matrix], format='csr')
+        updated._patch_neighbors(self, kept_rows)
+        return updated
+    
+    def _patch_neighbors(self, previous, kept_rows):
+        """Rebuild the neighbour index from previous's, whose kept_rows became this catalog's first rows"""
+        # Kept rows that lost a neighbour and new rows are rescored; the rest merge in matches among the new rows
+        num_rows = len(self.meals)
+        num_kept = len(kept_rows)
+        k = max(min(SIMILARITY_TOP_K, num_rows - 1), 0)
+        
+        old_to_new = np.full(len(previous.meals), -1, dtype=np.int32)
+        old_to_new[kept_rows] = np.arange(num_kept, dtype=np.int32)
+        kept_indices = old_to_new[previous.neighbor_indices[kept_rows]]
+        kept_scores = previous.neighbor_scores[kept_rows]
+        lost = (kept_indices < 0).any(axis=1)
+        
+        indices = np.empty((num_rows, k), dtype=np.int32)
+        scores = np.empty((num_rows, k), dtype=np.float32)
+        
+        intact = np.flatnonzero(~lost)
+        new_indices, new_scores = top_k_neighbors(self.tfidf_matrix[intact], self.tfidf_matrix[num_kept:], k)
+        indices[intact], scores[intact] = merge_neighbors(
+            kept_indices[intact], kept_scores[intact], new_indices + num_kept, new_scores, k)
+        
+        rescored = np.concatenate([np.flatnonzero(lost), np.arange(num_kept, num_rows)])
+        indices[rescored], scores[rescored] = top_k_neighbors(
+            self.tfidf_matrix[rescored], self.tfidf_matrix, k, exclude=rescored)
+        
+        self.neighbor_indices = indices
+        self.neighbor_scores = scores
     
     def load_weekly_history(self):
         """Load weekly meal history from file"""
@@ -159,8 +1122,21 @@ class MealRecommender:
         self.weekly_meals[user_id].clear()
         self.save_weekly_history()
     
-    def get_recommendations(self, user_id, preferences, num_recommendations=3, day_number=None):
-        """Get personalized meal recommendations based on weight goal and nutrition requirements"""
+    def get_recommendations(self, user_id, preferences, num_recommendations=3, day_number=None,
+                            combination_mode='pruned', seed=None):
+        """Get personalized meal recommendations based on weight goal and nutrition requirements
+        
+        combination_mode picks how multi-item meals are searched: 'vectorized'
+        scores every 2- and 3-item bundle of a restaurant as NumPy arrays,
+        'pruned' walks them with a calorie-pruned search. Both pick the same
+        combination. seed (an int or a numpy Generator) drives this
+        request's own random source, so a seed makes the result reproducible
+        and concurrent calls never share random state.
+        """
+        if combination_mode not in ('vectorized', 'pruned'):
+            raise ValueError(f"Unknown combination mode: {combination_mode}")
+        rng = np.random.default_rng(seed)
+        
         # Get user's goal and calculate target ranges
         goal = preferences.get('goal', 'maintain').lower()
         
@@ -169,159 +1145,50 @@ class MealRecommender:
         if target_calories is None:
             raise ValueError("Target calories must be provided in preferences")
         
-        # Define nutrition ranges based on goal with exact specifications
-        if goal == 'maintain':
-            macro_ranges = {
-                'protein': {'min': 0.20, 'max': 0.30},  # 20-30%
-                'fat': {'min': 0.20, 'max': 0.35},      # 20-35%
-                'carbs': {'min': 0.40, 'max': 0.50}     # 40-50%
-            }
-        elif goal == 'lose':
-            macro_ranges = {
-                'protein': {'min': 0.30, 'max': 0.40},  # 30-40%
-                'fat': {'min': 0.20, 'max': 0.35},      # 20-35%
-                'carbs': {'min': 0.45, 'max': 0.55}     # 45-55%
-            }
-        elif goal == 'gain':
-            macro_ranges = {
-                'protein': {'min': 0.25, 'max': 0.35},  # 25-35%
-                'fat': {'min': 0.30, 'max': 0.40},      # 30-40%
-                'carbs': {'min': 0.45, 'max': 0.55}     # 45-55%
-            }
-        else:
-            # Default to maintain if goal is not specified
-            macro_ranges = {
-                'protein': {'min': 0.20, 'max': 0.30},
-                'fat': {'min': 0.20, 'max': 0.35},
-                'carbs': {'min': 0.40, 'max': 0.50}
-            }
-        
-        # Calculate target calories per meal (divide by 3 for breakfast, lunch, dinner)
-        target_calories_per_meal = target_calories / 3
+        # Look up the cached goal profile; unknown goals default to maintain
+        profile = goal_profile(resolve_goal(goal, 'maintain'), target_calories)
+        macro_ranges = profile['macro_ranges']
         
-        # Calculate target macros in grams per meal
-        target_macros_per_meal = {
-            'protein': (target_calories_per_meal * macro_ranges['protein']['min']) / 4,  # 4 calories per gram
-            'carbs': (target_calories_per_meal * macro_ranges['carbs']['min']) / 4,      # 4 calories per gram
-            'fat': (target_calories_per_meal * macro_ranges['fat']['min']) / 9           # 9 calories per gram
-        }
+        # Calories are split evenly across breakfast, lunch and dinner, so every slot has the same targets
+        slot = profile['slots']['breakfast']
+        target_calories_per_meal = slot['calories']
+        calorie_bounds = (slot['calorie_floor'], slot['calorie_ceiling'])
         
-        # Filter meals based on preferences
-        filtered_meals = []
-        
-        for meal in self.meals:
-            # Skip meals with no nutrition data
-            if not meal.get('calories') or not meal.get('protein') or not meal.get('carbohydrate') or not meal.get('fat'):
-                continue
-            
-            # Calculate portion size based on serving information
-            serving = meal.get('serving', '')
-            portion_multiplier = 1.0
-            
-            # Check if this is a catering/tray meal
-            if 'tray' in serving.lower() or 'container' in serving.lower() or 'serves' in serving.lower():
-                # Try to extract number of servings
-                serves_match = re.search(r'serves\s*(\d+)', serving.lower())
-                if serves_match:
-                    portion_multiplier = 1.0 / float(serves_match.group(1))
-                else:
-                    # Default to 10 servings if not specified
-                    portion_multiplier = 0.1
-            
-            # Create a portioned version of the meal
-            portioned_meal = meal.copy()
-            portioned_meal['calories'] = meal['calories'] * portion_multiplier
-            portioned_meal['protein'] = meal['protein'] * portion_multiplier
-            portioned_meal['carbohydrate'] = meal['carbohydrate'] * portion_multiplier
-            portioned_meal['fat'] = meal['fat'] * portion_multiplier
-            portioned_meal['serving_size'] = f"{portion_multiplier:.2f} of {serving}"
-            
-            # Skip meals that are still too large for a single meal
-            if portioned_meal['calories'] > target_calories_per_meal * 1.03:  # Allow up to 130% of target
-                continue
-                
-            filtered_meals.append(portioned_meal)
-        
-        if not filtered_meals:
-            print("No meals passed basic filtering. Using all meals...")
-            filtered_meals = self.meals
-        
-        # Score individual meals first
-        scored_meals = []
-        for meal in filtered_meals:
-            meal_calories = meal.get('calories', 0)
-            meal_protein = meal.get('protein', 0)
-            meal_carbs = meal.get('carbohydrate', 0)
-            meal_fat = meal.get('fat', 0)
-            
-            if meal_calories == 0:
-                continue
-            
-            # Calculate macro percentages
-            protein_percent = (meal_protein * 4 / meal_calories)
-            carbs_percent = (meal_carbs * 4 / meal_calories)
-            fat_percent = (meal_fat * 9 / meal_calories)
-            
-            # Score based on how well macros fit target ranges (more precise)
-            macro_score = 0
-            # Protein score (higher is better)
-            if protein_percent < macro_ranges['protein']['min']:
-                protein_score = protein_percent / macro_ranges['protein']['min']
-            elif protein_percent > macro_ranges['protein']['max']:
-                protein_score = 1 - (protein_percent - macro_ranges['protein']['max']) / (1 - macro_ranges['protein']['max'])
-            else:
-                protein_score = 1.0
-            
-            # Carbs score
-            if carbs_percent < macro_ranges['carbs']['min']:
-                carbs_score = carbs_percent / macro_ranges['carbs']['min']
-            elif carbs_percent > macro_ranges['carbs']['max']:
-                carbs_score = 1 - (carbs_percent - macro_ranges['carbs']['max']) / (1 - macro_ranges['carbs']['max'])
-            else:
-                carbs_score = 1.0
-            
-            # Fat score
-            if fat_percent < macro_ranges['fat']['min']:
-                fat_score = fat_percent / macro_ranges['fat']['min']
-            elif fat_percent > macro_ranges['fat']['max']:
-                fat_score = 1 - (fat_percent - macro_ranges['fat']['max']) / (1 - macro_ranges['fat']['max'])
-            else:
-                fat_score = 1.0
-            
-            macro_score = (protein_score + carbs_score + fat_score) / 3
-            
-            # Score based on calorie match (more precise)
-            calorie_score = 1 - min(abs(meal_calories - target_calories_per_meal) / target_calories_per_meal, 1)
-            
-            # Add random factor for variety (smaller range for more consistency)
-            random_factor = random.uniform(0.9, 1.03)
-            
-            # Calculate overall score with weights (60% macros, 40% calories)
-            overall_score = (macro_score * 0.6 + calorie_score * 0.4) * random_factor
-            
-            scored_meals.append((overall_score, meal))
-        
-        # Sort by score
-        scored_meals.sort(reverse=True, key=lambda x: x[0])
+        # Score the whole catalog at once; rows come back ranked best first
+        ranked_rows, ranked_scores, portion_multipliers = self.score_meals(slot, macro_ranges, rng)
         
         # Get recommendations for each meal time
         meal_times = ['breakfast', 'lunch', 'dinner']
         all_recommendations = []
         
         for meal_time in meal_times:
-            # Filter meals for this meal time
-            time_filtered_meals = [(score, meal) for score, meal in scored_meals 
-                                 if meal_time.lower() in meal.get('mealType', '').lower()]
+            # Filter meals for this meal time, keeping the ranking order
+            time_mask = self.meal_type_mask(meal_time)[ranked_rows]
+            time_rows = ranked_rows[time_mask]
+            time_scores = ranked_scores[time_mask]
             
-            if not time_filtered_meals:
+            if len(time_rows) == 0:
                 print(f"No {meal_time} meals found, using all meals...")
-                time_filtered_meals = scored_meals
+                time_rows = ranked_rows
+                time_scores = ranked_scores
+            
+            # Select from top 50 meals for better quality
+            top_rows = time_rows[:50]
+            top_score_array = time_scores[:50]
+            top_scores = top_score_array.tolist()
+            top_restaurants = self.restaurant_codes[top_rows].tolist()
+            multipliers = portion_multipliers[top_rows]
+            top_arrays = (
+                self.meal_calories[top_rows] * multipliers,
+                self.meal_protein[top_rows] * multipliers,
+                self.meal_carbohydrate[top_rows] * multipliers,
+                self.meal_fat[top_rows] * multipliers
+            )
+            top_nutrition = tuple(values.tolist() for values in top_arrays)
             
             # Try different combinations of meals
             for num_meals in range(2, 4):  # Try 2 or 3 meals
-                # Select from top 50 meals for better quality
-                top_meals = time_filtered_meals[:50]
-                random.shuffle(top_meals)
+                top_meals = rng.permutation(len(top_rows)).tolist()
                 
                 best_combination = None
                 best_total_score = float('-inf')
@@ -329,100 +1196,26 @@ class MealRecommender:
                 
                 # Group meals by restaurant
                 restaurant_meals = {}
-                for score, meal in top_meals:
-                    restaurant = meal.get('restaurantName', 'Unknown Restaurant')
-                    if restaurant not in restaurant_meals:
-                        restaurant_meals[restaurant] = []
-                    restaurant_meals[restaurant].append((score, meal))
+                for position in top_meals:
+                    restaurant_meals.setdefault(top_restaurants[position], []).append(position)
                 
                 # Try combinations from each restaurant
                 for restaurant, meals in restaurant_meals.items():
                     if len(meals) < num_meals:
                         continue
-                        
-                    for meal_combination in combinations(meals, num_meals):
-                        total_calories = 0
-                        total_macros = {
-                            'protein': 0,
-                            'carbs': 0,
-                            'fat': 0
-                        }
-                        
-                        # Calculate totals for this combination
-                        for _, meal in meal_combination:
-                            total_calories += meal.get('calories', 0)
-                            total_macros['protein'] += meal.get('protein', 0)
-                            total_macros['carbs'] += meal.get('carbohydrate', 0)
-                            total_macros['fat'] += meal.get('fat', 0)
-                        
-                        if total_calories == 0:
-                            continue
-                        
-                        # Skip combinations that exceed calorie limit
-                        if total_calories > target_calories_per_meal * 1.03:  # Allow 30% flexibility
-                            continue
-                        
-                        # Skip combinations that are too low in calories
-                        if total_calories < target_calories_per_meal * 0.97:  # Require at least 70% of target
-                            continue
-                        
-                        # Calculate macro percentages for the combination
-                        protein_percent = (total_macros['protein'] * 4 / total_calories)
-                        carbs_percent = (total_macros['carbs'] * 4 / total_calories)
-                        fat_percent = (total_macros['fat'] * 9 / total_calories)
-                        
-                        # Skip combinations that don't meet macro requirements
-                        if (protein_percent < macro_ranges['protein']['min'] or 
-                            protein_percent > macro_ranges['protein']['max'] or
-                            carbs_percent < macro_ranges['carbs']['min'] or 
-                            carbs_percent > macro_ranges['carbs']['max'] or
-                            fat_percent < macro_ranges['fat']['min'] or 
-                            fat_percent > macro_ranges['fat']['max']):
-                            continue
-                        
-                        # Score based on macro percentages (more precise)
-                        macro_score = 0
-                        # Protein score
-                        if protein_percent < macro_ranges['protein']['min']:
-                            protein_score = protein_percent / macro_ranges['protein']['min']
-                        elif protein_percent > macro_ranges['protein']['max']:
-                            protein_score = 1 - (protein_percent - macro_ranges['protein']['max']) / (1 - macro_ranges['protein']['max'])
-                        else:
-                            protein_score = 1.0
-                        
-                        # Carbs score
-                        if carbs_percent < macro_ranges['carbs']['min']:
-                            carbs_score = carbs_percent / macro_ranges['carbs']['min']
-                        elif carbs_percent > macro_ranges['carbs']['max']:
-                            carbs_score = 1 - (carbs_percent - macro_ranges['carbs']['max']) / (1 - macro_ranges['carbs']['max'])
-                        else:
-                            carbs_score = 1.0
-                        
-                        # Fat score
-                        if fat_percent < macro_ranges['fat']['min']:
-                            fat_score = fat_percent / macro_ranges['fat']['min']
-                        elif fat_percent > macro_ranges['fat']['max']:
-                            fat_score = 1 - (fat_percent - macro_ranges['fat']['max']) / (1 - macro_ranges['fat']['max'])
-                        else:
-                            fat_score = 1.0
-                        
-                        macro_score = (protein_score + carbs_score + fat_score) / 3
-                        
-                        # Score based on calorie match
-                        calorie_score = 1 - min(abs(total_calories - target_calories_per_meal) / target_calories_per_meal, 1)
-                        
-                        # Calculate total match score (70% macro match, 30% calorie match)
-                        total_match_score = (macro_score * 0.7 + calorie_score * 0.3)
-                        
-                        # Calculate combination score (weighted average of individual scores and total match)
-                        individual_scores = sum(score for score, _ in meal_combination) / num_meals
-                        combination_score = (total_match_score * 0.8 + individual_scores * 0.2)
-                        
-                        # Update best combination if we find a better score
-                        if combination_score > best_total_score:
-                            best_total_score = combination_score
-                            best_total_match = total_match_score
-                            best_combination = meal_combination
+                    
+                    if combination_mode == 'vectorized' and num_meals <= 3:
+                        result = best_meal_combination_vectorized(meals, num_meals, top_arrays, top_score_array,
+                                                                  target_calories_per_meal, macro_ranges, *calorie_bounds)
+                    else:
+                        result = best_meal_combination(meals, num_meals, top_nutrition, top_scores,
+                                                       target_calories_per_meal, macro_ranges, *calorie_bounds)
+                    
+                    # Update best combination if we find a better score
+                    if result is not None and result[0] > best_total_score:
+                        best_total_score, best_total_match, meal_combination = result
+                        best_combination = [(top_scores[position], self._portioned_meal(top_rows[position], multipliers[position]))
+                                            for position in meal_combination]
                 
                 # If we found any valid combinations, create a combined meal
                 if best_combination:
@@ -469,6 +1262,74 @@ class MealRecommender:
         
         return all_recommendations  # Return all three meals
     
+    def score_meals(self, slot, macro_ranges, rng=None):
+        """Score every catalog row for one meal slot
+        
+        slot is the slot's goal profile entry, which supplies the calorie
+        target and the ceiling a single portion may not pass. Returns the
+        row indices ranked best first, their scores and the portion
+        multiplier applied to each catalog row. rng (a numpy Generator or
+        seed) supplies the variety noise.
+        """
+        rng = np.random.default_rng(rng)
+        target_calories_per_meal = slot['calories']
+        # Portion sizes were parsed from the serving text at load time
+        portion_multipliers = self.portion_multipliers
+        calories = self.portioned_calories
+        protein = self.portioned_protein
+        carbs = self.portioned_carbohydrate
+        fat = self.portioned_fat
+        
+        # Skip meals with no nutrition data and meals still too large for a single meal
+        keep = ((self.meal_calories != 0) & (self.meal_protein != 0)
+                & (self.meal_carbohydrate != 0) & (self.meal_fat != 0)
+                & ~(calories > slot['calorie_ceiling']))
+        rows = np.flatnonzero(keep)
+        
+        if len(rows) == 0:
+            print("No meals passed basic filtering. Using all meals...")
+            portion_multipliers = np.ones(len(self.meals))
+            calories = self.meal_calories
+            protein = self.meal_protein
+            carbs = self.meal_carbohydrate
+            fat = self.meal_fat
+            rows = np.flatnonzero(calories != 0)
+        
+        meal_calories = calories[rows]
+        protein_percent = protein[rows] * 4 / meal_calories
+        carbs_percent = carbs[rows] * 4 / meal_calories
+        fat_percent = fat[rows] * 9 / meal_calories
+        
+        # Score based on how well macros fit target ranges
+        macro_score = (macro_range_scores(protein_percent, macro_ranges['protein'])
+                       + macro_range_scores(carbs_percent, macro_ranges['carbs'])
+                       + macro_range_scores(fat_percent, macro_ranges['fat'])) / 3
+        
+        # Score based on calorie match
+        calorie_score = 1 - np.minimum(np.abs(meal_calories - target_calories_per_meal) / target_calories_per_meal, 1)
+        
+        # Add random factor for variety (smaller range for more consistency), drawn as one vector
+        random_factor = rng.uniform(0.9, 1.03, size=len(rows))
+        
+        # Calculate overall score with weights (60% macros, 40% calories)
+        scores = (macro_score * 0.6 + calorie_score * 0.4) * random_factor
+        
+        # Stable sort keeps catalog order between equal scores
+        order = np.argsort(-scores, kind='stable')
+        return rows[order], scores[order], portion_multipliers
+    
+    def _portioned_meal(self, row, portion_multiplier):
+        """Copy of a catalog meal scaled to a single portion"""
+        meal = self.meals[row]
+        portion_multiplier = float(portion_multiplier)
+        portioned_meal = dict(meal)
+        portioned_meal['calories'] = meal['calories'] * portion_multiplier
+        portioned_meal['protein'] = meal['protein'] * portion_multiplier
+        portioned_meal['carbohydrate'] = meal['carbohydrate'] * portion_multiplier
+        portioned_meal['fat'] = meal['fat'] * portion_multiplier
+        portioned_meal['serving_size'] = f"{portion_multiplier:.2f} of {meal.get('serving', '')}"
+        return portioned_meal
+    
     def filter_meals(self, preferences):
         """Filter meals based on user preferences"""
         filtered = []
@@ -621,87 +1482,163 @@ class MealRecommender:
     
     def is_similar_item(self, item1, item2):
         """Check if two meal items are similar based on their names and ingredients"""
-        # Convert to lowercase for comparison
-        name1 = item1['mealName'].lower()
-        name2 = item2['mealName'].lower()
+        return similar_features(similarity_features(item1), similarity_features(item2))
+    
+    def build_similarity_features(self, features=None, token_matrices=None, pattern_masks=None):
+        """Precompute each meal's name tokens, ingredient set and name-pattern bitmask
         
-        # Get ingredients lists
-        ingredients1 = set(ing.lower() for ing in item1.get('ingredients', []))
-        ingredients2 = set(ing.lower() for ing in item2.get('ingredients', []))
+        features optionally gives the similarity_features tuples of every
+        row, and token_matrices the (name, ingredient) incidence matrices and
+        pattern_masks the bitmask array, when they are already known.
+        """
+        if features is None:
+            features = [similarity_features(meal) for meal in self.meals]
+        self.name_token_sets = [name_tokens for name_tokens, _, _ in features]
+        self.ingredient_sets = [ingredients for _, ingredients, _ in features]
+        self.pattern_bits = [patterns for _, _, patterns in features]
+        self.pattern_masks = np.array(self.pattern_bits, dtype=np.int64) if pattern_masks is None else pattern_masks
         
-        # Check for common words in names
-        name_words1 = set(name1.split())
-        name_words2 = set(name2.split())
-        common_name_words = name_words1.intersection(name_words2)
+        # Binary row x token matrices, so overlap counts for many pairs are one sparse product
+        if token_matrices is None:
+            token_matrices = token_matrix(self.name_token_sets), token_matrix(self.ingredient_sets)
+        self.name_token_matrix, self.ingredient_matrix = token_matrices
+    
+    def similar_to_any(self, row, selected_rows, selected_patterns=None):
+        """Whether catalog row is similar to any of selected_rows (see is_similar_item)
         
-        # If more than 2 common words in names, likely similar
-        if len(common_name_words) >= 2:
-            return True
-            
-        # Check for common ingredients
-        common_ingredients = ingredients1.intersection(ingredients2)
-        if len(common_ingredients) >= 3:  # If 3 or more common ingredients
+        selected_patterns is the OR of the selected rows' pattern bits; callers
+        that add rows one at a time can keep it up to date and pass it in.
+        """
+        if not selected_rows:
+            return False
+        if selected_patterns is None:
+            selected_patterns = 0
+            for other in selected_rows:
+                selected_patterns |= self.pattern_bits[other]
+        # Shared name pattern with any selected row is a single bit test
+        if self.pattern_bits[row] & selected_patterns:
             return True
-            
-        # Check for specific patterns
-        patterns = ['nugget', 'burger', 'sandwich', 'salad', 'pizza', 'pasta', 'rice', 'chicken', 'beef', 'fish']
-        for pattern in patterns:
-            if pattern in name1 and pattern in name2:
+        name_tokens = self.name_token_sets[row]
+        ingredients = self.ingredient_sets[row]
+        for other in selected_rows:
+            if len(name_tokens & self.name_token_sets[other]) >= 2 or len(ingredients & self.ingredient_sets[other]) >= 3:
                 return True
-                
         return False
+    
+    def similar_rows_mask(self, rows, selected_rows):
+        """Vectorized similar_to_any: boolean mask over rows of those similar to any selected row"""
+        rows = np.asarray(rows, dtype=np.intp)
+        selected_rows = np.asarray(selected_rows, dtype=np.intp)
+        if len(rows) == 0 or len(selected_rows) == 0:
+            return np.zeros(len(rows), dtype=bool)
+        
+        selected_patterns = np.bitwise_or.reduce(self.pattern_masks[selected_rows])
+        similar = (self.pattern_masks[rows] & selected_patterns) != 0
+        # Pairwise overlap counts as sparse products of the token incidence matrices
+        common_names = self.name_token_matrix[rows] @ self.name_token_matrix[selected_rows].T
+        common_ingredients = self.ingredient_matrix[rows] @ self.ingredient_matrix[selected_rows].T
+        similar |= (common_names.max(axis=1).toarray().ravel() >= 2)
+        similar |= (common_ingredients.max(axis=1).toarray().ravel() >= 3)
+        return similar
 
     def recommend_meal_plan(self, user_id, preferences, days=7):
         """Recommend a meal plan with 3 days of franchise meals and 4 days of dining hall meals"""
-        # Define macro ranges based on goal
-        goal = preferences.get('goal', 'maintain').lower()
+        return self._build_meal_plan(self.prepare_plan_context(preferences))
+    
+    def recommend_meal_plans(self, requests, days=7, workers=None, pool=None):
+        """Recommend meal plans for many (user_id, preferences) pairs, one result dict per request"""
+        # Users with the same goal and calories share one plan computation and each get a copy
+        requests = list(requests)
+        keys = []
+        unique_preferences = {}
+        for user_id, preferences in requests:
+            try:
+                key = plan_context_key(preferences)
+                unique_preferences.setdefault(key, preferences)
+            except Exception as e:
+                key = e
+            keys.append(key)
         
-        # Get target calories from preferences
-        target_calories = preferences.get('target_calories')
-        if target_calories is None:
-            raise ValueError("Target calories must be provided in preferences")
+        outcomes = self._plan_outcomes(unique_preferences, workers, pool)
         
-        if goal == 'maintain':
-            macro_ranges = {
-                'protein': {'min': 0.20, 'max': 0.30},  # 20-30%
-                'fat': {'min': 0.20, 'max': 0.35},      # 20-35%
-                'carbs': {'min': 0.40, 'max': 0.50}     # 40-50%
-            }
-        elif goal == 'lose':
-            macro_ranges = {
-                'protein': {'min': 0.30, 'max': 0.40},  # 30-40%
-                'fat': {'min': 0.20, 'max': 0.35},      # 20-35%
-                'carbs': {'min': 0.45, 'max': 0.55}     # 45-55%
-            }
-        else:  # gain
-            macro_ranges = {
-                'protein': {'min': 0.25, 'max': 0.35},  # 25-35%
-                'fat': {'min': 0.30, 'max': 0.40},      # 30-40%
-                'carbs': {'min': 0.45, 'max': 0.55}     # 45-55%
+        results = []
+        for (user_id, _), key in zip(requests, keys):
+            status, value = ('error', str(key)) if isinstance(key, Exception) else outcomes[key]
+            if status == 'success':
+                results.append({
+                    'user_id': user_id,
+                    'status': 'success',
+                    'meal_plan': copy_meal_plan(value)
+                })
+            else:
+                results.append({
+                    'user_id': user_id,
+                    'status': 'error',
+                    'message': value
+                })
+        return results
+    
+    def _plan_outcomes(self, unique_preferences, workers=None, pool=None):
+        """Build one plan per distinct preferences, as key -> (status, plan or message)"""
+        preferences = list(unique_preferences.values())
+        outcomes = None
+        if pool is not None:
+            # Without a snapshot of this catalog in the pool, plans are built in-process
+            if len(preferences) > 1:
+                try:
+                    outcomes = pool.map(self, preferences)
+                except (OSError, ValueError):
+                    # Snapshot removed after later swaps, or the pool shut down
+                    outcomes = None
+        elif min(workers or 1, len(preferences)) > 1 and 'fork' in multiprocessing.get_all_start_methods():
+            # For scripts: forked workers share the parent's catalog pages, but forking a
+            # multi-threaded server can deadlock the children, so servers pass a PlanWorkerPool
+            context = multiprocessing.get_context('fork')
+            with context.Pool(min(workers, len(preferences)), initializer=_init_plan_worker,
+                              initargs=(self,)) as call_pool:
+                outcomes = call_pool.map(_plan_worker, [(None, preference) for preference in preferences])
+        
+        if outcomes is not None:
+            return {key: (status, unpack_meal_plan(value, self.meals) if status == 'success' else value)
+                    for key, (status, value) in zip(unique_preferences, outcomes)}
+        return {key: build_plan_outcome(self, preferences) for key, preferences in unique_preferences.items()}
+    
+    def prepare_plan_context(self, preferences):
+        """Targets and slot candidates shared by every plan with the same goal and calories"""
+        goal, target_calories = plan_context_key(preferences)
+        
+        # Macro ranges and per-meal-type targets (30/40/30 split) come from the cached goal profile
+        profile = goal_profile(goal, target_calories, PLAN_MEAL_SPLIT)
+        macro_ranges = profile['macro_ranges']
+        meal_type_targets = profile['slots']
+        
+        # Candidates that fit a slot on their own; anything heavier can never be picked
+        candidates = {}
+        for (category, meal_type), restaurants in self.candidate_index.items():
+            if meal_type not in meal_type_targets:
+                continue
+            ceiling = meal_type_targets[meal_type]['calorie_ceiling']
+            candidates[(category, meal_type)] = {
+                restaurant: rows[self.meal_calories[rows] <= ceiling]
+                for restaurant, rows in restaurants.items()
             }
-
-        # Define meal type calorie distribution
-        meal_type_distribution = {
-            'breakfast': 0.30,  # 30% of daily calories
-            'lunch': 0.40,      # 40% of daily calories
-            'dinner': 0.30      # 30% of daily calories
+        
+        return {
+            'macro_ranges': macro_ranges,
+            'meal_type_targets': meal_type_targets,
+            'candidates': candidates
         }
-
-        # Calculate target macros in grams for each meal type
-        meal_type_targets = {}
-        for meal_type, percentage in meal_type_distribution.items():
-            meal_calories = target_calories * percentage
-            meal_type_targets[meal_type] = {
-                'calories': meal_calories,
-                'protein': (meal_calories * macro_ranges['protein']['min']) / 4,  # 4 calories per gram
-                'carbs': (meal_calories * macro_ranges['carbs']['min']) / 4,      # 4 calories per gram
-                'fat': (meal_calories * macro_ranges['fat']['min']) / 9           # 9 calories per gram
-            }
-
+    
+    def _build_meal_plan(self, context):
+        """Build a 7-day meal plan from a prepare_plan_context() result"""
+        macro_ranges = context['macro_ranges']
+        meal_type_targets = context['meal_type_targets']
+        candidates = context['candidates']
+        
         meal_plan = []
-        used_meals = set()  # Track all meals used in the plan
+        used_ids = np.zeros(len(self.meal_id_labels), dtype=bool)  # Track all meals used in the plan, by mealId code
         used_restaurants = set()  # Track used restaurants for franchise days
-        used_meal_names = set()  # Track meal names to prevent duplicates
+        used_names = np.zeros(len(self.meal_name_labels), dtype=bool)  # Track meal names to prevent duplicates
         
         # Create 3 franchise days
         for day in range(3):
@@ -717,58 +1654,47 @@ class MealRecommender:
                 targets = meal_type_targets[meal_type]
                 current_totals = meal_type_totals[meal_type]
                 
-                # Get available franchise meals for this meal type
-                available_meals = [m for m in self.meals 
-                                 if m['mealId'] not in used_meals 
-                                 and m['restaurantName'] not in used_restaurants
-                                 and m['category'] == 'Franchise'
-                                 and m['mealType'].lower() == meal_type.lower()
-                                 and m['mealName'] not in used_meal_names]
+                # Get available franchise meals for this meal type, grouped by restaurant
+                restaurant_groups = self._available_candidates('Franchise', meal_type, candidates, used_ids,
+                                                               used_names, used_restaurants)
                 
-                if not available_meals:
+                if not restaurant_groups:
                     # If no new restaurants available, allow previously used ones
-                    available_meals = [m for m in self.meals 
-                                     if m['mealId'] not in used_meals 
-                                     and m['category'] == 'Franchise'
-                                     and m['mealType'].lower() == meal_type.lower()
-                                     and m['mealName'] not in used_meal_names]
+                    restaurant_groups = self._available_candidates('Franchise', meal_type, candidates, used_ids,
+                                                                   used_names)
                 
-                if available_meals:
-                    # Group meals by restaurant first
-                    restaurant_groups = defaultdict(list)
-                    for meal in available_meals:
-                        restaurant_groups[meal['restaurantName']].append(meal)
-                    
+                if restaurant_groups:
                     # Try to find a restaurant with enough meals for this meal type
                     selected_meals = []
+                    selected_rows = []
+                    selected_patterns = 0
                     selected_restaurant = None
                     
-                    # Sort restaurants by number of available meals
-                    sorted_restaurants = sorted(restaurant_groups.items(), 
-                                             key=lambda x: len(x[1]), 
-                                             reverse=True)
+                    # Sort restaurants by number of available meals, then by first appearance
+                    sorted_restaurants = sorted(restaurant_groups, key=lambda group: -group[2])
                     
-                    for restaurant, meals in sorted_restaurants:
-                        # Remove the fixed limit of 3 meals per restaurant
-                        # Sort meals by protein content for better macro balance
-                        meals.sort(key=lambda x: x.get('protein', 0), reverse=True)
-                        
-                        for meal in meals:
+                    for restaurant, rows, _ in sorted_restaurants:
+                        # Candidates are pre-sorted by protein content for better macro balance
+                        for row in rows:
+                            # Annotations go on a request-local view; the catalog meal is shared
+                            meal = MealView(self.meals[row], row)
                             # Check if this meal is similar to any already selected meal
-                            if any(self.is_similar_item(meal, selected) for selected in selected_meals):
+                            if self.similar_to_any(row, selected_rows, selected_patterns):
                                 continue
                                 
                             new_calories = current_totals['calories'] + meal.get('calories', 0)
                             # Allow more flexibility in calorie targets
-                            if new_calories <= targets['calories'] * 1.03:  # Increased from 1.03 to 1.3
-                                meal['is_franchise'] = True
+                            if new_calories <= targets['calorie_ceiling']:
+                                meal.annotations['is_franchise'] = True
                                 # Preserve the original meal type from JSON
                                 if meal['mealType'].lower() != meal_type.lower():
                                     print(f"Warning: Meal {meal['mealName']} has type {meal['mealType']} but is being assigned to {meal_type}")
                                     continue
                                 selected_meals.append(meal)
-                                used_meals.add(meal['mealId'])
-                                used_meal_names.add(meal['mealName'])
+                                selected_rows.append(row)
+                                selected_patterns |= self.pattern_bits[row]
+                                used_ids[self.meal_id_codes[row]] = True
+                                used_names[self.meal_name_codes[row]] = True
                                 current_totals['calories'] += meal.get('calories', 0)
                                 current_totals['protein'] += meal.get('protein', 0)
                                 current_totals['fat'] += meal.get('fat', 0)
@@ -785,7 +1711,7 @@ class MealRecommender:
             if day_meals:
                 # Add category information to each meal
                 for meal in day_meals:
-                    meal['display_category'] = 'Franchise'
+                    meal.annotations['display_category'] = 'Franchise'
                 
                 # Group meals by type
                 meals_by_type = {
@@ -814,38 +1740,32 @@ class MealRecommender:
                 targets = meal_type_targets[meal_type]
                 current_totals = meal_type_totals[meal_type]
                 
-                # Get available dining hall meals for this meal type
-                available_meals = [m for m in self.meals 
-                                 if m['mealId'] not in used_meals 
-                                 and m['category'] == 'Dining-Halls'
-                                 and m['mealType'].lower() == meal_type.lower()]
+                # Get available dining hall meals for this meal type, grouped by dining hall
+                restaurant_groups = self._available_candidates('Dining-Halls', meal_type, candidates, used_ids)
                 
-                if available_meals:
-                    # Group meals by dining hall (restaurant)
-                    restaurant_groups = defaultdict(list)
-                    for meal in available_meals:
-                        restaurant_groups[meal['restaurantName']].append(meal)
-                    
+                if restaurant_groups:
                     # Try to find a dining hall with enough meals for this meal type
                     selected_meals = []
-                    for restaurant, meals in restaurant_groups.items():
-                        # Remove the fixed limit of 3 meals per dining hall
-                        # Sort meals by protein content for better macro balance
-                        meals.sort(key=lambda x: x.get('protein', 0), reverse=True)
-                        
-                        for meal in meals:
+                    selected_rows = []
+                    selected_patterns = 0
+                    for restaurant, rows, _ in restaurant_groups:
+                        # Candidates are pre-sorted by protein content for better macro balance
+                        for row in rows:
+                            meal = MealView(self.meals[row], row)
                             # Check if this meal is similar to any already selected meal
-                            if any(self.is_similar_item(meal, selected) for selected in selected_meals):
+                            if self.similar_to_any(row, selected_rows, selected_patterns):
                                 continue
                                 
                             new_calories = current_totals['calories'] + meal.get('calories', 0)
                             # Allow more flexibility in calorie targets
-                            if new_calories <= targets['calories'] * 1.03:  # Increased from 1.03 to 1.3
-                                meal['is_franchise'] = False
+                            if new_calories <= targets['calorie_ceiling']:
+                                meal.annotations['is_franchise'] = False
                                 # Keep the original meal type from JSON
-                                meal['mealType'] = meal['mealType'].lower()
+                                meal.annotations['mealType'] = meal['mealType'].lower()
                                 selected_meals.append(meal)
-                                used_meals.add(meal['mealId'])
+                                selected_rows.append(row)
+                                selected_patterns |= self.pattern_bits[row]
+                                used_ids[self.meal_id_codes[row]] = True
                                 current_totals['calories'] = new_calories
                                 current_totals['protein'] += meal.get('protein', 0)
                                 current_totals['carbs'] += meal.get('carbohydrate', 0)
@@ -859,7 +1779,7 @@ class MealRecommender:
             if day_meals:
                 # Add category information to each meal
                 for meal in day_meals:
-                    meal['display_category'] = 'Dining Hall'
+                    meal.annotations['display_category'] = 'Dining Hall'
                 
                 # Group meals by type
                 meals_by_type = {
@@ -874,29 +1794,6 @@ class MealRecommender:
                     'category': 'Dining Hall'
                 })
         
-        def validate_meal_combination(meals, targets):
-            """Validate if a combination of meals meets macro requirements"""
-            total_calories = sum(meal.get('calories', 0) for meal in meals)
-            total_protein = sum(meal.get('protein', 0) for meal in meals)
-            total_carbs = sum(meal.get('carbohydrate', 0) for meal in meals)
-            total_fat = sum(meal.get('fat', 0) for meal in meals)
-
-            if total_calories == 0:
-                return False
-
-            # Calculate macro percentages
-            protein_percent = (total_protein * 4 / total_calories)
-            carbs_percent = (total_carbs * 4 / total_calories)
-            fat_percent = (total_fat * 9 / total_calories)
-
-            # Check if within target ranges
-            return (
-                abs(total_calories - targets['calories']) <= targets['calories'] * 0.1 and  # Within 10% of target
-                macro_ranges['protein']['min'] <= protein_percent <= macro_ranges['protein']['max'] and
-                macro_ranges['carbs']['min'] <= carbs_percent <= macro_ranges['carbs']['max'] and
-                macro_ranges['fat']['min'] <= fat_percent <= macro_ranges['fat']['max']
-            )
-
         # Modify meal selection to consider macro requirements
         for day in meal_plan:
             for meal_type in ['breakfast', 'lunch', 'dinner']:
@@ -904,44 +1801,63 @@ class MealRecommender:
                     meals = day['meals_by_type'][meal_type]
                     targets = meal_type_targets[meal_type]
                     
-                    # Try different combinations until we find one that meets requirements
-                    from itertools import combinations
-                    best_combination = None
-                    best_score = float('-inf')
-                    
-                    # Allow for larger combinations by increasing the max combo size
-                    for combo_size in range(1, min(6, len(meals) + 1)):  # Increased from 4 to 6
-                        for combo in combinations(meals, combo_size):
-                            if validate_meal_combination(combo, targets):
-                                # Score based on how well it matches targets
-                                total_calories = sum(meal.get('calories', 0) for meal in combo)
-                                score = 1 - abs(total_calories - targets['calories']) / targets['calories']
-                                
-                                if score > best_score:
-                                    best_score = score
-                                    best_combination = combo
+                    # Find the subset of up to 5 meals closest to the calorie target within the macro ranges
+                    nutrition = (
+                        [meal.get('calories', 0) for meal in meals],
+                        [meal.get('protein', 0) for meal in meals],
+                        [meal.get('carbohydrate', 0) for meal in meals],
+                        [meal.get('fat', 0) for meal in meals]
+                    )
+                    best_combination = best_macro_combination(nutrition, targets['calories'], macro_ranges,
+                                                              targets['calorie_window'])
                     
                     if best_combination:
-                        day['meals_by_type'][meal_type] = list(best_combination)
+                        day['meals_by_type'][meal_type] = [meals[i] for i in best_combination]
 
         return meal_plan
     
     def get_similar_meals(self, meal_id, num_similar=5):
         """Get similar meals based on content"""
-        try:
-            idx = next(i for i, meal in enumerate(self.meals) if meal['mealId'] == meal_id)
-            similar_indices = self.similarity_matrix[idx].argsort()[-num_similar-1:-1][::-1]
-            return [self.meals[i] for i in similar_indices]
-        except StopIteration:
+        idx = self.meal_index.get(meal_id)
+        if idx is None:
             return []
+        similar_indices = self._similar_rows(np.array([idx]), num_similar)[0]
+        return [dict(self.meals[i]) for i in similar_indices]
+    
+    def get_similar_meals_batch(self, meal_ids, num_similar=5):
+        """Get similar meals for many mealIds in one call, keyed by mealId"""
+        similar_meals = {meal_id: [] for meal_id in meal_ids}
+        found = [meal_id for meal_id in similar_meals if meal_id in self.meal_index]
+        if not found:
+            return similar_meals
+        
+        rows = np.array([self.meal_index[meal_id] for meal_id in found])
+        for meal_id, similar_indices in zip(found, self._similar_rows(rows, num_similar)):
+            similar_meals[meal_id] = [dict(self.meals[i]) for i in similar_indices]
+        return similar_meals
+    
+    def _similar_rows(self, rows, num_similar):
+        """Nearest-neighbour row indices for each of rows, best first"""
+        if isinstance(num_similar, bool) or not isinstance(num_similar, (int, np.integer)) or num_similar < 1:
+            raise ValueError("num_similar must be a positive integer")
+        if num_similar <= self.neighbor_indices.shape[1]:
+            return self.neighbor_indices[rows, :num_similar]
+        # Beyond the precomputed neighbours, score the requested rows on demand
+        return top_k_neighbors(self.tfidf_matrix[rows], self.tfidf_matrix, num_similar, exclude=rows)[0]
 
-    def display_meal_plan(self, meal_plan):
-        """Display the meal plan with macro information"""
+    def display_meal_plan(self, meal_plan, preferences=None):
+        """Display the meal plan with macro information
+        
+        Pass the request's preferences when the recommender is shared
+        between threads; without them the stored user_preferences are used.
+        """
         days_of_week = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
         formatted_plan = []
         
-        # Get target calories from user preferences
-        target_calories = self.user_preferences.get('target_calories', 2000)  # Default to 2000 if not set
+        # Get target calories from the given or stored user preferences
+        if preferences is None:
+            preferences = self.user_preferences
+        target_calories = preferences.get('target_calories', 2000)  # Default to 2000 if not set
         
         for day_idx, day in enumerate(meal_plan):
             day_num = day['day']
@@ -966,8 +1882,8 @@ class MealRecommender:
                     meals = day['meals_by_type'][meal_type]
                     
                     for meal in meals:
-                        # Add meal to the appropriate meal type
-                        day_meals[meal_type].append(meal)
+                        # Add meal to the appropriate meal type, as a plain dict ready for JSON
+                        day_meals[meal_type].append(dict(meal))
                         
                         # Update daily totals
                         daily_totals['calories'] += meal.get('calories', 0)
@@ -989,6 +1905,26 @@ class MealRecommender:
             "weeklyPlan": formatted_plan
         }
 
+    @staticmethod
+    def goal_profile_cache_info():
+        """Hit/miss counts of the shared goal profile cache"""
+        return goal_profile.cache_info()._asdict()
+
+    def freeze(self):
+        """Make the catalog arrays read-only and return self
+        
+        Planning keeps all per-request state in local arrays and MealViews,
+        so a frozen recommender can be shared by any number of threads
+        without locking; an accidental in-place write raises instead of
+        leaking into other requests. with_updates() still works, since it
+        builds new arrays for the recommender it returns.
+        """
+        arrays = [value for value in vars(self).values() if isinstance(value, np.ndarray)]
+        arrays.extend(rows for restaurants in self.candidate_index.values() for rows in restaurants.values())
+        for array in arrays:
+            array.flags.writeable = False
+        return self
+
     def set_user_preferences(self, preferences):
-        """Update user preferences"""
+        """Update the stored user preferences (single-user use; shared recommenders take them per call)"""
         self.user_preferences.update(preferences)
\ No newline at end of file
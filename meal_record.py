@@ -0,0 +1,123 @@
+import sys
+from collections.abc import Mapping
+
+# Fields stored in Meal slots; anything else a record carries is kept alongside
+MEAL_FIELDS = (
+    '_id', 'mealId', 'mealName', 'mealType', 'restaurantName', 'restaurantId', 'category', 'serving',
+    'calories', 'protein', 'carbohydrate', 'fat', 'ingredients', 'allergens', 'dietaryPreferences',
+    'feature_string', 'health_score', 'portion_multiplier'
+)
+_MEAL_FIELD_SET = frozenset(MEAL_FIELDS)
+
+# Short strings shared by many meals; interning keeps one copy of each
+INTERNED_FIELDS = frozenset(('mealType', 'restaurantName', 'restaurantId', 'category', 'serving'))
+
+# List fields, stored as tuples of interned strings
+TUPLE_FIELDS = frozenset(('ingredients', 'allergens', 'dietaryPreferences'))
+
+# Marks a slot whose field the record did not have
+_MISSING = object()
+
+class Meal(Mapping):
+    """Immutable catalog meal with a read-only dict interface
+
+    Built once from a normalized menu record. Planning never changes it;
+    per-request annotations go on a MealView instead.
+    """
+    __slots__ = MEAL_FIELDS + ('_extra',)
+
+    def __init__(self, fields):
+        set_slot = object.__setattr__
+        intern = sys.intern
+        for key in MEAL_FIELDS:
+            value = fields.get(key, _MISSING)
+            if type(value) is str:
+                if key in INTERNED_FIELDS:
+                    value = intern(value)
+            elif key in TUPLE_FIELDS and isinstance(value, (list, tuple)):
+                value = tuple([intern(item) if type(item) is str else item for item in value])
+            set_slot(self, key, value)
+        extra = {key: value for key, value in fields.items() if key not in _MEAL_FIELD_SET}
+        set_slot(self, '_extra', extra or None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Meal records are immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("Meal records are immutable")
+
+    def __getitem__(self, key):
+        if key in _MEAL_FIELD_SET:
+            value = getattr(self, key)
+            if value is not _MISSING:
+                return value
+        elif self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        if key in _MEAL_FIELD_SET:
+            value = getattr(self, key)
+            return default if value is _MISSING else value
+        if self._extra is not None:
+            return self._extra.get(key, default)
+        return default
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __iter__(self):
+        for key in MEAL_FIELDS:
+            if getattr(self, key) is not _MISSING:
+                yield key
+        if self._extra is not None:
+            yield from self._extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"Meal({dict(self)!r})"
+
+    def __reduce__(self):
+        return Meal, (dict(self),)
+
+class MealView(Mapping):
+    """A catalog Meal with request-local annotations layered on top
+
+    Lookups check annotations first, so a plan can relabel a meal
+    (e.g. its display category) without touching the shared record. row is
+    the meal's catalog row, which lets a plan be sent between processes
+    without the meals themselves.
+    """
+    __slots__ = ('meal', 'row', 'annotations')
+
+    def __init__(self, meal, row=None, annotations=None):
+        self.meal = meal
+        self.row = row
+        self.annotations = {} if annotations is None else annotations
+
+    def __getitem__(self, key):
+        if key in self.annotations:
+            return self.annotations[key]
+        return self.meal[key]
+
+    def get(self, key, default=None):
+        if key in self.annotations:
+            return self.annotations[key]
+        return self.meal.get(key, default)
+
+    def __contains__(self, key):
+        return key in self.annotations or key in self.meal
+
+    def __iter__(self):
+        yield from self.meal
+        for key in self.annotations:
+            if key not in self.meal:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"MealView({dict(self)!r})"
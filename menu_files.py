@@ -0,0 +1,31 @@
+import gzip
+import json
+import os
+
+# Newline-delimited menu exports, optionally followed by .gz
+NDJSON_SUFFIXES = ('.ndjson', '.jsonl')
+
+def open_menu_file(path, mode='r'):
+    """Open a menu export as text, gzip-compressed when the name ends in .gz"""
+    path = os.fspath(path)
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+def is_ndjson(path):
+    """Whether path names a newline-delimited export rather than one JSON array"""
+    path = os.fspath(path)
+    if path.endswith('.gz'):
+        path = path[:-len('.gz')]
+    return path.endswith(NDJSON_SUFFIXES)
+
+def iter_ndjson(f):
+    """Yield the records of an open newline-delimited file one at a time"""
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+def read_menu_ndjson(path):
+    """Yield the records of a newline-delimited menu export one at a time"""
+    with open_menu_file(path) as f:
+        yield from iter_ndjson(f)
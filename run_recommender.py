@@ -6,6 +6,7 @@ import random
 from dotenv import load_dotenv
 import os
 from pymongo import MongoClient
+from setup_mongodb import build_menu_pipeline, aggregate_menu_items
 
 # Define meal options by category
 MEAL_OPTIONS = {
@@ -213,8 +214,10 @@ def get_meal_plan_option():
         except ValueError:
             print("Please enter a valid number.")
 
-def get_meals_to_remove(option):
+def get_meals_to_remove(option, rng=None):
     """Get which meals to remove based on the selected option"""
+    if rng is None:
+        rng = random.Random()
     if option == 1:
         print("\nStep 1: Ask for Meal Preferences")
         print("Available meal types:")
@@ -247,7 +250,7 @@ def get_meals_to_remove(option):
                 if len(selected_meals) == len(choices):  # All choices were valid
                     if len(selected_meals) == 3:
                         # If all three selected, randomly remove one meal from 2 random days
-                        meals_to_remove = random.sample(['breakfast', 'lunch', 'dinner'], 1)
+                        meals_to_remove = rng.sample(['breakfast', 'lunch', 'dinner'], 1)
                         return meals_to_remove[0]
                     elif len(selected_meals) == 2:
                         # If two selected, remove the unselected one
@@ -258,7 +261,7 @@ def get_meals_to_remove(option):
                         # Remove one random meal from unselected types
                         all_meals = ['breakfast', 'lunch', 'dinner']
                         unselected = [meal for meal in all_meals if meal not in selected_meals]
-                        return random.choice(unselected)
+                        return rng.choice(unselected)
             
             except ValueError:
                 print("Please enter valid numbers separated by spaces.")
@@ -293,14 +296,16 @@ def get_meals_to_remove(option):
             except ValueError:
                 print("Please enter valid numbers.")
 
-def modify_meal_plan(meal_plan, option, meals_to_remove):
+def modify_meal_plan(meal_plan, option, meals_to_remove, rng=None):
     """Modify the meal plan based on the selected option"""
+    if rng is None:
+        rng = random.Random()
     if option == 1:
         # For option 1, we only modify the first 3 days (franchise days)
         franchise_days = meal_plan[:3]
         
         # Randomly select 2 days from the first 3
-        days_to_modify = random.sample(range(3), 2)
+        days_to_modify = rng.sample(range(3), 2)
         
         # Remove the specified meal type from the selected days
         for day_idx in days_to_modify:
@@ -352,44 +357,10 @@ def get_mongodb_data():
         restaurants_collection = db.restaurants
         
         # Get all menu items using aggregation pipeline
-        pipeline = [
-            {"$match": {"campus": {"$in": ["UMD"]}}},
-            {"$unwind": "$menu"},
-            {"$unwind": "$menu.items"},
-            {
-                "$lookup": {
-                    "from": "meals",
-                    "localField": "menu.items",
-                    "foreignField": "_id",
-                    "as": "mealDetails"
-                }
-            },
-            {"$unwind": "$mealDetails"},
-            {"$match": {"mealDetails.nutrients.calories": {"$gt": 0}}},
-            {"$match": {"mealDetails._id": {"$ne": None}}},
-            {
-                "$project": {
-                    "mealName": "$mealDetails.name",
-                    "mealType": "$mealDetails.type",
-                    "ingredients": "$mealDetails.ingredients",
-                    "allergens": "$mealDetails.allergens",
-                    "dietaryPreferences": "$mealDetails.dietaryPreferences",
-                    "serving": "$mealDetails.serving",
-                    "calories": "$mealDetails.nutrients.calories",
-                    "protein": "$mealDetails.nutrients.protein",
-                    "fat": "$mealDetails.nutrients.fat",
-                    "carbohydrate": "$mealDetails.nutrients.carbohydrate",
-                    "restaurantName": "$name",
-                    "restaurantId": "$_id",
-                    "category": "$category",
-                    "mealId": "$mealDetails._id"
-                }
-            }
-        ]
+        pipeline = build_menu_pipeline(['UMD'], sort=False)
         
-        menu_items = list(restaurants_collection.aggregate(pipeline))
-        print(f"\nFetched {len(menu_items)} menu items from MongoDB")
-        return menu_items
+        # Return the cursor itself so the recommender can consume it as it streams
+        return aggregate_menu_items(restaurants_collection, pipeline)
         
     except Exception as e:
         print(f"An error occurred while connecting to MongoDB: {str(e)}")
@@ -397,16 +368,9 @@ def get_mongodb_data():
 
 def main():
     try:
-        # Get data directly from MongoDB
-        menu_items = get_mongodb_data()
-        
-        # Save to temporary JSON file for the recommender
-        temp_json = 'temp_menu_data.json'
-        with open(temp_json, 'w', encoding='utf-8') as f:
-            json.dump(menu_items, f, default=str, indent=2)
-        
-        # Initialize the recommender with the temporary data
-        recommender = MealRecommender(temp_json)
+        # Build the recommender directly from the MongoDB cursor
+        recommender = MealRecommender.from_records(get_mongodb_data())
+        print(f"\nFetched {len(recommender.meals)} menu items from MongoDB")
 
         # Get user's weight goal
         goal = get_weight_goal()
@@ -433,8 +397,11 @@ def main():
         # Get meal plan option
         option = get_meal_plan_option()
         
+        # One random source for this run's choices; MEAL_PLAN_SEED makes them repeatable
+        rng = random.Random(os.getenv('MEAL_PLAN_SEED'))
+        
         # Get meals to remove based on option
-        meals_to_remove = get_meals_to_remove(option)
+        meals_to_remove = get_meals_to_remove(option, rng)
         
         # Generate 7-day meal plan
         print("\nGenerating your meal plan...")
@@ -443,7 +410,7 @@ def main():
         meal_plan = recommender.recommend_meal_plan(user_id, user_prefs, days=7)
         
         # Modify meal plan based on user's choice
-        modified_meal_plan = modify_meal_plan(meal_plan, option, meals_to_remove)
+        modified_meal_plan = modify_meal_plan(meal_plan, option, meals_to_remove, rng)
         
         # Get the formatted meal plan
         formatted_plan = recommender.display_meal_plan(modified_meal_plan)
@@ -451,9 +418,6 @@ def main():
         # Print the formatted plan as JSON
         print(json.dumps(formatted_plan, indent=2))
 
-        # Clean up temporary file
-        os.remove(temp_json)
-
     except Exception as e:
         print(f"An unexpected error occurred: {str(e)}")
         import traceback
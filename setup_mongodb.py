@@ -3,25 +3,63 @@ from dotenv import load_dotenv
 import os
 from bson import ObjectId
 import json
+import re
+import argparse
+from datetime import datetime
+from itertools import islice
+from menu_files import open_menu_file, read_menu_ndjson
 
 def get_all_restaurants(restaurants_collection):
     """Get all restaurant names"""
     return list(restaurants_collection.find({}))
 
-def get_all_menu_items(restaurants_collection, campus='UMD'):
-    """Get all menu items using the aggregation pipeline"""
+# Cursor batch size for menu aggregations; large campuses return tens of thousands of rows
+MENU_BATCH_SIZE = 1000
+
+def build_menu_pipeline(campuses=('UMD',), meal_ids=None, category=None, meal_type=None, sort=True):
+    """Aggregation pipeline producing one flat menu record per restaurant menu item
+    
+    Restaurant filters run before anything is unwound and item filters
+    before the $lookup, so only matching menu items are joined. meal_ids
+    limits the output to those meals (as strings or ObjectIds), which lets a
+    sync re-read just the meals that changed. category matches the
+    restaurant category. meal_type matches the meal type case-insensitively
+    inside the $lookup, which needs MongoDB 5.0 or newer.
+    """
+    restaurant_match = {"campus": {"$in": list(campuses)}}
+    if category is not None:
+        restaurant_match["category"] = category
+    if meal_ids is not None:
+        meal_ids = [ObjectId(meal_id) if ObjectId.is_valid(meal_id) else meal_id for meal_id in meal_ids]
+        restaurant_match["menu.items"] = {"$in": meal_ids}
+    
     pipeline = [
-        {"$match": {"campus": {"$in": [campus]}}},
+        {"$match": restaurant_match},
+        # Only the fields the menu records use travel through the unwinds
+        {"$project": {"name": 1, "category": 1, "menu.items": 1}},
         {"$unwind": "$menu"},
-        {"$unwind": "$menu.items"},
-        {
-            "$lookup": {
-                "from": "meals",
-                "localField": "menu.items",
-                "foreignField": "_id",
-                "as": "mealDetails"
-            }
-        },
+        {"$unwind": "$menu.items"}
+    ]
+    if meal_ids is not None:
+        # Drop the other items of matching restaurants before joining against meals
+        pipeline.append({"$match": {"menu.items": {"$in": meal_ids}}})
+    
+    lookup = {
+        "from": "meals",
+        "localField": "menu.items",
+        "foreignField": "_id",
+        "as": "mealDetails"
+    }
+    if meal_type is not None:
+        # Join only meals of the requested type, carrying just the fields the records use
+        lookup["pipeline"] = [
+            {"$match": {"type": {"$regex": f"^{re.escape(meal_type)}$", "$options": "i"}}},
+            {"$project": {"name": 1, "type": 1, "ingredients": 1, "allergens": 1,
+                          "dietaryPreferences": 1, "serving": 1, "nutrients": 1}}
+        ]
+    
+    pipeline += [
+        {"$lookup": lookup},
         {"$unwind": "$mealDetails"},
         {"$match": {"mealDetails.nutrients.calories": {"$gt": 0}}},
         {"$match": {"mealDetails._id": {"$ne": None}}},
@@ -42,13 +80,57 @@ def get_all_menu_items(restaurants_collection, campus='UMD'):
                 "category": "$category",
                 "mealId": "$mealDetails._id"
             }
-        },
-        {"$sort": {"calories": -1}}
+        }
     ]
+    if sort:
+        pipeline.append({"$sort": {"calories": -1}})
+    return pipeline
+
+def aggregate_menu_items(restaurants_collection, pipeline, batch_size=MENU_BATCH_SIZE):
+    """Run a menu pipeline, letting large sorts spill to disk and fetching in big batches"""
+    return restaurants_collection.aggregate(pipeline, allowDiskUse=True, batchSize=batch_size)
+
+def get_all_menu_items(restaurants_collection, campus='UMD', category=None, meal_type=None):
+    """Get all menu items using the aggregation pipeline; campus may also be a list of campuses"""
+    campuses = [campus] if isinstance(campus, str) else campus
+    pipeline = build_menu_pipeline(campuses, category=category, meal_type=meal_type)
+    
+    return list(aggregate_menu_items(restaurants_collection, pipeline))
+
+def export_menu_ndjson(restaurants_collection, output_file, campuses=('UMD',), batch_size=MENU_BATCH_SIZE):
+    """Stream menu items of the given campuses to a newline-delimited JSON file
     
-    return list(restaurants_collection.aggregate(pipeline))
+    The cursor is read and written one batch at a time, so memory stays
+    bounded by batch_size however large the catalog is. Returns the number
+    of items written and the first few items as a sample.
+    """
+    pipeline = build_menu_pipeline(campuses)
+    cursor = aggregate_menu_items(restaurants_collection, pipeline, batch_size)
+    count = 0
+    sample = []
+    with open_menu_file(output_file, 'w') as f:
+        while True:
+            batch = list(islice(cursor, batch_size))
+            if not batch:
+                break
+            if len(sample) < 3:
+                sample.extend(batch[:3 - len(sample)])
+            # Convert ObjectId to string, one record per line
+            f.write(''.join(json.dumps(item, default=str, ensure_ascii=False) + '\n' for item in batch))
+            count += len(batch)
+    return count, sample
 
-def setup_mongodb():
+def export_snapshot(menu_items, snapshot_dir, read_at=None):
+    """Compile menu items read from MongoDB at read_at into a catalog snapshot the recommender memory-maps at startup"""
+    # Imported here so the plain JSON export does not need the ML dependencies
+    from meal_recommender import MealRecommender
+    
+    recommender = MealRecommender.from_records(menu_items)
+    recommender.export_snapshot(snapshot_dir, read_at=read_at)
+    print(f"Compiled catalog snapshot of {len(recommender.meals)} meals to {snapshot_dir}")
+
+def setup_mongodb(snapshot_dir=None, campuses=('UMD',), output_file='menu_data.json', stream=False,
+                  batch_size=MENU_BATCH_SIZE):
     # Load environment variables
     load_dotenv()
     
@@ -74,27 +156,55 @@ def setup_mongodb():
         restaurants_collection = db.restaurants
         meals_collection = db.meals
         
-        # Get all menu items using the aggregation pipeline
         print("\nFetching menu items using aggregation pipeline...")
-        menu_items = get_all_menu_items(restaurants_collection, campus='UMD')
-        
-        # Save the menu items to a JSON file for the recommender system
-        output_file = 'menu_data.json'
-        with open(output_file, 'w', encoding='utf-8') as f:
-            # Convert ObjectId to string and format with indentation
-            json.dump(menu_items, f, default=str, indent=2, ensure_ascii=False)
+        # Taken before the aggregation so edits made while it runs are newer than the snapshot
+        read_at = datetime.utcnow()
+        if stream:
+            # Write records as they arrive instead of holding the whole menu in memory
+            count, menu_items = export_menu_ndjson(restaurants_collection, output_file, campuses, batch_size)
+            print(f"\nStreamed {count} menu items to {output_file}")
+            
+            if snapshot_dir:
+                export_snapshot(read_menu_ndjson(output_file), snapshot_dir, read_at=read_at)
+        else:
+            # Get all menu items using the aggregation pipeline
+            menu_items = get_all_menu_items(restaurants_collection, campus=list(campuses))
+            
+            # Save the menu items to a JSON file for the recommender system
+            with open(output_file, 'w', encoding='utf-8') as f:
+                # Convert ObjectId to string and format with indentation
+                json.dump(menu_items, f, default=str, indent=2, ensure_ascii=False)
+            
+            print(f"\nFetched {len(menu_items)} menu items and saved to {output_file}")
+            
+            if snapshot_dir:
+                export_snapshot(menu_items, snapshot_dir, read_at=read_at)
         
-        print(f"\nFetched {len(menu_items)} menu items and saved to {output_file}")
         print("\nSample menu items:")
         for item in menu_items[:3]:  # Show first 3 items
             print(f"\n{item['mealName']} at {item['restaurantName']}")
             print(f"Calories: {item['calories']}, Protein: {item['protein']}g")
         
-        return menu_items
+        return count if stream else menu_items
         
     except Exception as e:
         print(f"An error occurred: {str(e)}")
         raise
 
 if __name__ == "__main__":
-    setup_mongodb() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Export the campus menu from MongoDB")
+    parser.add_argument('--campus', action='append', dest='campuses', metavar='CAMPUS',
+                        help="campus to export; repeat for several (default: UMD)")
+    parser.add_argument('--output', default=None,
+                        help="output file (default: menu_data.json, or menu_data.ndjson with --stream)")
+    parser.add_argument('--stream', action='store_true',
+                        help="stream newline-delimited JSON in batches instead of one JSON array; "
+                             "an output name ending in .gz is gzip-compressed")
+    parser.add_argument('--batch-size', type=int, default=MENU_BATCH_SIZE,
+                        help="cursor batch size when streaming")
+    parser.add_argument('--snapshot', metavar='DIR',
+                        help="also compile a binary catalog snapshot into DIR")
+    args = parser.parse_args()
+    setup_mongodb(snapshot_dir=args.snapshot, campuses=args.campuses or ['UMD'],
+                  output_file=args.output or ('menu_data.ndjson' if args.stream else 'menu_data.json'),
+                  stream=args.stream, batch_size=args.batch_size) 
\ No newline at end of file
@@ -0,0 +1,149 @@
+import json
+import os
+from datetime import datetime, timedelta
+import mongomock
+import pytest
+from bson import ObjectId
+from meal_recommender import MealRecommender
+from catalog_sync import CatalogSync
+from setup_mongodb import build_menu_pipeline, aggregate_menu_items
+
+SAMPLE_MEALS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test1.json')
+
+@pytest.fixture
+def menu_db():
+    """mongomock database holding the first 300 sample meals, last touched a day ago"""
+    db = mongomock.MongoClient().test
+    touched = datetime.utcnow() - timedelta(days=1)
+    with open(SAMPLE_MEALS) as f:
+        records = json.load(f)[:300]
+
+    meals = {}
+    restaurants = {}
+    for record in records:
+        meal_id = ObjectId(record['mealId'])
+        meals[meal_id] = {
+            '_id': meal_id,
+            'name': record['mealName'],
+            'type': record.get('mealType'),
+            'ingredients': record.get('ingredients', []),
+            'allergens': record.get('allergens', []),
+            'serving': record.get('serving'),
+            'nutrients': {macro: record[macro] for macro in ('calories', 'protein', 'fat', 'carbohydrate')},
+            'updatedAt': touched
+        }
+        restaurant = restaurants.setdefault(record['restaurantName'], {
+            '_id': ObjectId(),
+            'name': record['restaurantName'],
+            'campus': 'UMD',
+            'category': record.get('category'),
+            'menu': [{'items': []}],
+            'updatedAt': touched
+        })
+        if meal_id not in restaurant['menu'][0]['items']:
+            restaurant['menu'][0]['items'].append(meal_id)
+
+    db.meals.insert_many(list(meals.values()))
+    db.restaurants.insert_many(list(restaurants.values()))
+    return db
+
+def build_catalog(db):
+    return MealRecommender.from_records(aggregate_menu_items(db.restaurants, build_menu_pipeline(sort=False)))
+
+def catalog_rows(recommender):
+    return sorted((meal['mealId'], meal['restaurantId'], meal['mealName'], meal['calories'])
+                  for meal in recommender.meals)
+
+def live_sync(db):
+    """A CatalogSync over a catalog built from db, and a getter for the live recommender"""
+    live = {'recommender': build_catalog(db)}
+
+    def apply_updates(upserts, removed_ids):
+        live['recommender'] = live['recommender'].with_updates(upserts, removed_ids)
+
+    # mongomock keeps updatedAt to the millisecond, so rely on the lag rather than exact timestamps
+    sync = CatalogSync(db, lambda: live['recommender'], apply_updates,
+                       since=datetime.utcnow() - timedelta(hours=1), lag=5)
+    return sync, lambda: live['recommender']
+
+def test_sync_matches_full_rebuild(menu_db):
+    sync, get_recommender = live_sync(menu_db)
+    now = datetime.utcnow()
+
+    # Edit a meal
+    edited_id = menu_db.meals.find_one()['_id']
+    menu_db.meals.update_one({'_id': edited_id}, {'$set': {'name': 'Renamed Meal', 'updatedAt': now}})
+
+    # Drop an item from a restaurant menu and add a brand new meal in its place
+    restaurant = menu_db.restaurants.find_one()
+    items = restaurant['menu'][0]['items']
+    dropped_id = items[-1]
+    new_id = ObjectId()
+    menu_db.meals.insert_one(dict(menu_db.meals.find_one({'_id': items[0]}), _id=new_id,
+                                  name='Brand New Wrap', updatedAt=now))
+    menu_db.restaurants.update_one({'_id': restaurant['_id']},
+                                   {'$set': {'menu': [{'items': items[:-1] + [new_id]}], 'updatedAt': now}})
+
+    upserted, removed = sync.sync_once()
+    assert upserted > 0 and removed > 0
+
+    live = get_recommender()
+    names = {meal['mealId']: meal['mealName'] for meal in live.meals}
+    assert names[str(edited_id)] == 'Renamed Meal'
+    assert names[str(new_id)] == 'Brand New Wrap'
+    assert not any(meal['mealId'] == str(dropped_id) and meal['restaurantId'] == str(restaurant['_id'])
+                   for meal in live.meals)
+    assert catalog_rows(live) == catalog_rows(build_catalog(menu_db))
+
+def test_sync_without_changes_keeps_catalog(menu_db):
+    sync, get_recommender = live_sync(menu_db)
+    before = get_recommender()
+
+    assert sync.sync_once() == (0, 0)
+    assert get_recommender() is before
+
+class FakeChangeStream:
+    """Change stream that yields the given changes, then fails like a dropped connection"""
+    def __init__(self, changes):
+        self.changes = list(changes)
+        self.resume_token = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def try_next(self):
+        if not self.changes:
+            raise ConnectionError("stream dropped")
+        change = self.changes.pop(0)
+        self.resume_token = change['_id']
+        return change
+
+def test_change_stream_catches_up_and_keeps_read_changes(menu_db):
+    sync, get_recommender = live_sync(menu_db)
+    sync.use_change_stream = True
+    meals = list(menu_db.meals.find().limit(2))
+
+    # Edited before the stream opens: only the catch-up sync can see it
+    menu_db.meals.update_one({'_id': meals[0]['_id']}, {'$set': {'name': 'Edited Offline', 'updatedAt': datetime.utcnow()}})
+    # Edited with an old timestamp: only the stream reports it
+    menu_db.meals.update_one({'_id': meals[1]['_id']}, {'$set': {'name': 'Streamed Edit'}})
+
+    opened = []
+    def watch(pipeline, **kwargs):
+        opened.append(kwargs.get('resume_after'))
+        return FakeChangeStream([{'_id': {'token': 1}, 'ns': {'coll': 'meals'}, 'documentKey': {'_id': meals[1]['_id']}}])
+    menu_db.watch = watch
+
+    with pytest.raises(ConnectionError):
+        sync.watch()
+    names = {meal['mealId']: meal['mealName'] for meal in get_recommender().meals}
+    assert names[str(meals[0]['_id'])] == 'Edited Offline'
+    assert names[str(meals[1]['_id'])] == 'Streamed Edit'
+
+    # A reconnect resumes after the last change read
+    with pytest.raises(ConnectionError):
+        sync.watch()
+    assert opened == [None, {'token': 1}]
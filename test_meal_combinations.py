@@ -0,0 +1,110 @@
+import random
+from itertools import combinations
+import numpy as np
+import pytest
+from meal_recommender import best_meal_combination, best_meal_combination_vectorized, best_macro_combination
+
+MACRO_RANGES = {
+    'protein': {'min': 0.2, 'max': 0.35},
+    'carbs': {'min': 0.3, 'max': 0.55},
+    'fat': {'min': 0.15, 'max': 0.4}
+}
+
+def random_menu(rng, size):
+    """(calories, protein, carbs, fat) lists and scores, with repeated values so ties come up"""
+    calories = [rng.choice([rng.uniform(50, 600), 200.0, 300.0]) for _ in range(size)]
+    protein = [c * rng.uniform(0.15, 0.4) / 4 for c in calories]
+    carbs = [c * rng.uniform(0.3, 0.6) / 4 for c in calories]
+    fat = [c * rng.uniform(0.1, 0.45) / 9 for c in calories]
+    scores = [rng.choice([0.5, 0.7, rng.random()]) for _ in range(size)]
+    return (calories, protein, carbs, fat), scores
+
+def in_macro_ranges(total_calories, total_protein, total_carbs, total_fat, macro_ranges):
+    percents = {
+        'protein': total_protein * 4 / total_calories,
+        'carbs': total_carbs * 4 / total_calories,
+        'fat': total_fat * 9 / total_calories
+    }
+    return all(macro_ranges[macro]['min'] <= percent <= macro_ranges[macro]['max']
+               for macro, percent in percents.items())
+
+def exhaustive_meal_combination(candidates, num_meals, nutrition, scores, target_calories, floor, ceiling):
+    """Plain combinations() scan that best_meal_combination must agree with"""
+    best = None
+    for combination in combinations(candidates, num_meals):
+        totals = [0, 0, 0, 0]
+        for position in combination:
+            for i, values in enumerate(nutrition):
+                totals[i] += values[position]
+        if totals[0] == 0 or not floor <= totals[0] <= ceiling:
+            continue
+        if not in_macro_ranges(*totals, MACRO_RANGES):
+            continue
+        calorie_score = 1 - min(abs(totals[0] - target_calories) / target_calories, 1)
+        total_match_score = 1.0 * 0.7 + calorie_score * 0.3
+        combination_score = total_match_score * 0.8 + sum(scores[position] for position in combination) / num_meals * 0.2
+        if best is None or combination_score > best[0]:
+            best = (combination_score, total_match_score, combination)
+    return best
+
+@pytest.mark.parametrize('seed', range(4))
+def test_best_meal_combination_matches_exhaustive_scan(seed):
+    rng = random.Random(seed)
+    for _ in range(200):
+        size = rng.randint(1, 12)
+        nutrition, scores = random_menu(rng, size)
+        candidates = rng.sample(range(size), size)
+        num_meals = rng.randint(1, 4)
+        target = rng.choice([500.0, 600.0, rng.uniform(200, 1200)])
+        bounds = (target * 0.97, target * 1.03)
+        assert (best_meal_combination(candidates, num_meals, nutrition, scores, target, MACRO_RANGES, *bounds)
+                == exhaustive_meal_combination(candidates, num_meals, nutrition, scores, target, *bounds))
+
+@pytest.mark.parametrize('seed', range(4))
+def test_vectorized_meal_combination_matches_exhaustive_scan(seed):
+    rng = random.Random(100 + seed)
+    for _ in range(200):
+        size = rng.randint(1, 16)
+        nutrition, scores = random_menu(rng, size)
+        candidates = rng.sample(range(size), size)
+        num_meals = rng.randint(2, 3)
+        target = rng.choice([500.0, 600.0, rng.uniform(200, 1200)])
+        bounds = (target * 0.97, target * 1.03)
+        arrays = tuple(np.array(values) for values in nutrition)
+        assert (best_meal_combination_vectorized(candidates, num_meals, arrays, np.array(scores), target,
+                                                 MACRO_RANGES, *bounds)
+                == exhaustive_meal_combination(candidates, num_meals, nutrition, scores, target, *bounds))
+
+def exhaustive_macro_combination(nutrition, target_calories, macro_ranges, calorie_window, max_items=5):
+    """Size-by-size combinations() scan that best_macro_combination must agree with"""
+    low, high = calorie_window
+    best = None
+    best_score = float('-inf')
+    for size in range(1, min(max_items, len(nutrition[0])) + 1):
+        for indices in combinations(range(len(nutrition[0])), size):
+            totals = [sum(values[i] for i in indices) for values in nutrition]
+            if totals[0] == 0 or not low <= totals[0] <= high or not in_macro_ranges(*totals, macro_ranges):
+                continue
+            score = 1 - abs(totals[0] - target_calories) / target_calories
+            if score > best_score:
+                best, best_score = indices, score
+    return best
+
+@pytest.mark.parametrize('seed', range(4))
+def test_best_macro_combination_matches_exhaustive_scan(seed):
+    rng = random.Random(200 + seed)
+    wide_ranges = {'protein': {'min': 0.1, 'max': 0.5}, 'carbs': {'min': 0.2, 'max': 0.7}, 'fat': {'min': 0.05, 'max': 0.6}}
+    for _ in range(150):
+        size = rng.randint(0, 10)
+        calories = [rng.choice([rng.uniform(20, 900), 100.0, 250.0, 0.0]) for _ in range(size)]
+        nutrition = (
+            calories,
+            [c * rng.uniform(0.1, 0.45) / 4 for c in calories],
+            [c * rng.uniform(0.25, 0.6) / 4 for c in calories],
+            [c * rng.uniform(0.1, 0.45) / 9 for c in calories]
+        )
+        macro_ranges = rng.choice([MACRO_RANGES, wide_ranges])
+        target = rng.choice([600.0, 800.0, rng.uniform(100, 1500)])
+        window = (target - target * 0.1, target + target * 0.1)
+        assert (best_macro_combination(nutrition, target, macro_ranges, window)
+                == exhaustive_macro_combination(nutrition, target, macro_ranges, window))